@@ -0,0 +1,445 @@
+# MockServer.py
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import time
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+
+MODRINTH_CDN = 'http://cdn.modrinth.com'
+CURSEFORGE_CDN = 'http://edge.forgecdn.net'
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Project:
+    """One fake project, which exists on both platforms under the same slug.
+
+    Every value is derived from (kind, index), so the catalog never has to be held in memory: 'mod' projects are the
+    ones in the modlist, each requiring one 'lib' project (shared by about ten mods), and every lib requires the single 'core' project.
+    """
+
+    PREFIXES = {'mod': 'M', 'lib': 'L', 'core': 'C'}
+    CURSEFORGE_BASE = {'mod': 1_000_000, 'lib': 2_000_000, 'core': 3_000_000}
+
+    def __init__(self, catalog: 'Catalog', kind: str, index: int) -> None:
+        self.catalog = catalog
+        self.kind = kind
+        self.index = index
+
+        self.slug = 'core-lib' if kind == 'core' else f'{kind}-{index}'
+        self.modrinth_id = f'{self.PREFIXES[kind]}{index:07d}'
+        self.curseforge_id = self.CURSEFORGE_BASE[kind] + index
+        self.title = f'{kind.capitalize()} {index}'
+
+
+    def dependencies(self) -> list[tuple['Project', bool]]:
+        """(project, required) pairs."""
+        libraries = self.catalog.libraries
+        match self.kind:
+            case 'mod':
+                return [
+                    (Project(self.catalog, 'lib', self.index % libraries), True),
+                    (Project(self.catalog, 'lib', (self.index + 1) % libraries), False)
+                ]
+            case 'lib':
+                return [(Project(self.catalog, 'core', 0), True)]
+            case _:
+                return []
+
+
+
+    def modrinth(self) -> dict:
+        return {'id': self.modrinth_id, 'slug': self.slug, 'title': self.title, 'project_type': 'mod', 'downloads': 1000}
+
+
+    def modrinth_version(self, number: int) -> dict:
+        filename = f'{self.slug}-{number}.jar'
+        return {
+            'id': f'{self.modrinth_id}v{number}',
+            'project_id': self.modrinth_id,
+            'name': f'{self.title} {number}',
+            'version_number': f'1.{number}.0',
+            'changelog': 'Fixed things. ' * 40, # Real version lists are mostly changelogs
+            'date_published': (EPOCH + timedelta(days=number)).isoformat(),
+            'version_type': 'release',
+            'game_versions': ['1.20.1'],
+            'loaders': ['fabric', 'forge', 'neoforge', 'quilt'],
+            'files': [{
+                'url': f'{MODRINTH_CDN}/data/{self.modrinth_id}/versions/{number}/{filename}',
+                'filename': filename,
+                'hashes': self.catalog.jar_hashes,
+                'primary': True,
+                'size': self.catalog.jar_size
+            }],
+            'dependencies': [
+                {'project_id': project.modrinth_id, 'version_id': None, 'file_name': None, 'dependency_type': 'required' if required else 'optional'}
+                for project, required in self.dependencies()
+            ]
+        }
+
+
+    def modrinth_versions(self) -> list[dict]:
+        return [self.modrinth_version(number) for number in range(self.catalog.versions, 0, -1)]
+
+
+
+    def curseforge(self) -> dict:
+        return {
+            'id': self.curseforge_id,
+            'gameId': 432,
+            'classId': 6,
+            'name': self.title,
+            'slug': self.slug,
+            'links': {'websiteUrl': f'https://www.curseforge.com/minecraft/mc-mods/{self.slug}'},
+            'downloadCount': 1000
+        }
+
+
+    def curseforge_file(self, number: int) -> dict:
+        fileId = self.curseforge_id * 100 + number
+        filename = f'{self.slug}-{number}.jar'
+        return {
+            'id': fileId,
+            'gameId': 432,
+            'modId': self.curseforge_id,
+            'displayName': f'{self.title} {number}',
+            'fileName': filename,
+            'fileDate': (EPOCH + timedelta(days=number)).isoformat(),
+            'fileLength': self.catalog.jar_size,
+            'downloadUrl': f'{CURSEFORGE_CDN}/files/{fileId // 1000}/{fileId % 1000}/{filename}',
+            'hashes': [{'value': self.catalog.jar_hashes['sha1'], 'algo': 1}, {'value': self.catalog.jar_hashes['md5'], 'algo': 2}],
+            'gameVersions': ['1.20.1', 'Fabric', 'Forge', 'NeoForge', 'Quilt'],
+            'dependencies': [{'modId': project.curseforge_id, 'relationType': 3 if required else 2} for project, required in self.dependencies()]
+        }
+
+
+    def curseforge_files(self) -> list[dict]:
+        return [self.curseforge_file(number) for number in range(self.catalog.versions, 0, -1)]
+
+
+
+class Catalog:
+    """The fake projects served by the mock server.
+
+    Args:
+        mods (int): How many 'mod' projects exist (mod-0 ... mod-{mods - 1}).
+        libraries (int, optional): How many 'lib' projects the mods depend on. Defaults to one per ten mods.
+        versions (int, optional): Versions (files on Curseforge) listed per project.
+        jar_size (int, optional): Size in bytes of every jar.
+    """
+
+    def __init__(self, mods: int, *, libraries: int = None, versions: int = 5, jar_size: int = 32 * 1024) -> None:
+        self.mods = mods
+        self.libraries = libraries or max(1, mods // 10)
+        self.versions = versions
+        self.jar_size = jar_size
+
+        # Every jar has the same content, generating (and hashing) thousands of distinct ones would only slow the server down
+        self.jar = bytes(range(256)) * (jar_size // 256) + bytes(jar_size % 256)
+        self.jar_hashes = {
+            'sha1': hashlib.sha1(self.jar).hexdigest(),
+            'sha512': hashlib.sha512(self.jar).hexdigest(),
+            'md5': hashlib.md5(self.jar).hexdigest()
+        }
+        self.etag = f'"{self.jar_hashes["sha1"]}"'
+
+
+    def _make(self, kind: str, index: int) -> Project | None:
+        limit = {'mod': self.mods, 'lib': self.libraries, 'core': 1}[kind]
+        return Project(self, kind, index) if 0 <= index < limit else None
+
+
+    def by_slug(self, slug: str) -> Project | None:
+        if slug == 'core-lib':
+            return self._make('core', 0)
+
+        match = re.fullmatch(r'(mod|lib)-(\d+)', slug)
+        return self._make(match[1], int(match[2])) if match else None
+
+
+    def by_modrinth_id(self, key: str) -> Project | None:
+        """Modrinth takes slugs wherever it takes ids."""
+        match = re.fullmatch(r'([MLC])(\d{7})', key)
+        if match:
+            kind = {prefix: kind for kind, prefix in Project.PREFIXES.items()}[match[1]]
+            return self._make(kind, int(match[2]))
+        return self.by_slug(key)
+
+
+    def by_curseforge_id(self, id: int) -> Project | None:
+        for kind, base in Project.CURSEFORGE_BASE.items():
+            if base <= id < base + 1_000_000:
+                return self._make(kind, id - base)
+        return None
+
+
+    def by_curseforge_file_id(self, id: int) -> dict | None:
+        project = self.by_curseforge_id(id // 100)
+        if project is None or not 1 <= id % 100 <= self.versions:
+            return None
+        return project.curseforge_file(id % 100)
+
+
+
+class FixedWindow:
+    """Rate limit of one api, limit requests per window seconds, announced in X-Ratelimit-* headers like Modrinth does."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self.started = time.monotonic()
+        self.used = 0
+
+
+    def take(self) -> tuple[bool, dict]:
+        now = time.monotonic()
+        if now - self.started >= self.window:
+            self.started = now
+            self.used = 0
+
+        reset = max(1, round(self.window - (now - self.started)))
+        allowed = self.used < self.limit
+        if allowed:
+            self.used += 1
+
+        return allowed, {
+            'X-Ratelimit-Limit': str(self.limit),
+            'X-Ratelimit-Remaining': str(self.limit - self.used),
+            'X-Ratelimit-Reset': str(reset)
+        }
+
+
+
+class MockServer:
+    """Local aiohttp server answering the Modrinth and Curseforge endpoints mcmm calls, and the file downloads of both CDNs.
+
+    The server does not care about the Host header, the benchmarks resolve the real host names to it instead
+    (see HttpClient resolver), so mcmm runs unmodified, host groups and rate limit buckets included.
+
+    Args:
+        catalog (Catalog): The projects served.
+        latency (float, optional): Seconds added to every api response.
+        cdn_latency (float, optional): Seconds added before every download starts.
+        rate_limit (int, optional): Requests allowed per rate_window on each api, 0 for no limit.
+        rate_window (float, optional): Length of the rate limit window, in seconds.
+    """
+
+    def __init__(self, catalog: Catalog, *, latency: float = 0.05, cdn_latency: float = 0.02, rate_limit: int = 0, rate_window: float = 60) -> None:
+        self.catalog = catalog
+        self.latency = latency
+        self.cdn_latency = cdn_latency
+        self.limits = {api: FixedWindow(rate_limit, rate_window) for api in ('modrinth', 'curseforge')} if rate_limit else {}
+
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.bytes = 0
+
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/_mock/stats', self.stats)
+
+        app.router.add_get('/v2/projects', self.modrinth_projects)
+        app.router.add_get('/v2/project/{id}', self.modrinth_project)
+        app.router.add_get('/v2/project/{id}/version', self.modrinth_versions)
+        app.router.add_get('/v2/versions', self.modrinth_bulk_versions)
+        app.router.add_get('/v2/version/{id}', self.modrinth_version)
+
+        app.router.add_get('/v1/games', self.curseforge_games)
+        app.router.add_get('/v1/mods/search', self.curseforge_search)
+        app.router.add_post('/v1/mods', self.curseforge_mods)
+        app.router.add_get('/v1/mods/{id:\\d+}', self.curseforge_mod)
+        app.router.add_post('/v1/mods/files', self.curseforge_bulk_files)
+        app.router.add_get('/v1/mods/{id:\\d+}/files', self.curseforge_files)
+
+        app.router.add_get('/data/{tail:.*}', self.download)
+        app.router.add_get('/files/{tail:.*}', self.download)
+        return app
+
+
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        if request.path.startswith('/_mock/'):
+            return await handler(request)
+
+        api = 'modrinth' if request.path.startswith('/v2/') else 'curseforge' if request.path.startswith('/v1/') else 'cdn'
+        self.requests[f'{api} {request.method} {request.match_info.route.resource.canonical if request.match_info.route.resource else request.path}'] += 1
+
+        headers = {}
+        if api in self.limits:
+            allowed, headers = self.limits[api].take()
+            if not allowed:
+                self.statuses[429] += 1
+                return web.json_response({'error': 'ratelimited'}, status=429, headers={**headers, 'Retry-After': headers['X-Ratelimit-Reset']})
+
+        await asyncio.sleep(self.cdn_latency if api == 'cdn' else self.latency)
+
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            self.statuses[e.status] += 1
+            raise
+
+        response.headers.update(headers)
+        self.statuses[response.status] += 1
+        return response
+
+
+    async def stats(self, request: web.Request):
+        return web.json_response({
+            'requests': sum(self.requests.values()),
+            'endpoints': dict(self.requests.most_common()),
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'bytes': self.bytes
+        })
+
+
+
+    async def modrinth_projects(self, request: web.Request):
+        projects = (self.catalog.by_modrinth_id(id) for id in json.loads(request.query['ids']))
+        return web.json_response([project.modrinth() for project in projects if project])
+
+
+    async def modrinth_project(self, request: web.Request):
+        project = self.catalog.by_modrinth_id(request.match_info['id'])
+        if project is None:
+            raise web.HTTPNotFound()
+        return web.json_response(project.modrinth())
+
+
+    async def modrinth_versions(self, request: web.Request):
+        project = self.catalog.by_modrinth_id(request.match_info['id'])
+        if project is None:
+            raise web.HTTPNotFound()
+        return web.json_response(project.modrinth_versions())
+
+
+    def _modrinth_version(self, id: str) -> dict | None:
+        match = re.fullmatch(r'(\w+)v(\d+)', id)
+        project = self.catalog.by_modrinth_id(match[1]) if match else None
+        if project is None or not 1 <= int(match[2]) <= self.catalog.versions:
+            return None
+        return project.modrinth_version(int(match[2]))
+
+
+    async def modrinth_bulk_versions(self, request: web.Request):
+        versions = (self._modrinth_version(id) for id in json.loads(request.query['ids']))
+        return web.json_response([version for version in versions if version])
+
+
+    async def modrinth_version(self, request: web.Request):
+        version = self._modrinth_version(request.match_info['id'])
+        if version is None:
+            raise web.HTTPNotFound()
+        return web.json_response(version)
+
+
+
+    async def curseforge_games(self, request: web.Request):
+        return web.json_response({'data': [{'id': 432, 'name': 'Minecraft', 'slug': 'minecraft'}]})
+
+
+    async def curseforge_search(self, request: web.Request):
+        project = self.catalog.by_slug(request.query.get('slug', ''))
+        data = [project.curseforge()] if project else []
+        return web.json_response({'data': data, 'pagination': {'index': 0, 'pageSize': 50, 'resultCount': len(data), 'totalCount': len(data)}})
+
+
+    async def curseforge_mods(self, request: web.Request):
+        projects = (self.catalog.by_curseforge_id(int(id)) for id in (await request.json())['modIds'])
+        return web.json_response({'data': [project.curseforge() for project in projects if project]})
+
+
+    async def curseforge_mod(self, request: web.Request):
+        project = self.catalog.by_curseforge_id(int(request.match_info['id']))
+        if project is None:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': project.curseforge()})
+
+
+    async def curseforge_bulk_files(self, request: web.Request):
+        files = (self.catalog.by_curseforge_file_id(int(id)) for id in (await request.json())['fileIds'])
+        return web.json_response({'data': [file for file in files if file]})
+
+
+    async def curseforge_files(self, request: web.Request):
+        project = self.catalog.by_curseforge_id(int(request.match_info['id']))
+        if project is None:
+            raise web.HTTPNotFound()
+
+        index = int(request.query.get('index', 0))
+        pageSize = int(request.query.get('pageSize', 50))
+        files = project.curseforge_files()
+        page = files[index:index + pageSize]
+        return web.json_response({'data': page, 'pagination': {'index': index, 'pageSize': pageSize, 'resultCount': len(page), 'totalCount': len(files)}})
+
+
+
+    async def download(self, request: web.Request):
+        jar = self.catalog.jar
+        headers = {'ETag': self.catalog.etag, 'Accept-Ranges': 'bytes', 'Content-Type': 'application/java-archive'}
+
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        ifRange = request.headers.get('If-Range')
+        if match and (ifRange is None or ifRange == self.catalog.etag):
+            start = int(match[1])
+            end = min(int(match[2]) if match[2] else len(jar) - 1, len(jar) - 1)
+            if start > end:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{len(jar)}'})
+
+            self.bytes += end - start + 1
+            return web.Response(body=jar[start:end + 1], status=206, headers={**headers, 'Content-Range': f'bytes {start}-{end}/{len(jar)}'})
+
+        self.bytes += len(jar)
+        return web.Response(body=jar, headers=headers)
+
+
+
+async def serve(server: MockServer, host: str, port: int):
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    # The benchmark reads the port from the first line, port 0 picks a free one
+    print(f'listening on {runner.addresses[0][1]}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Mock Modrinth/Curseforge server for the mcmm benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='0 picks a free port')
+    parser.add_argument('--mods', type=int, default=1000, help='How many mods exist')
+    parser.add_argument('--libraries', type=int, default=None, help='How many shared libraries the mods depend on, defaults to mods / 10')
+    parser.add_argument('--versions', type=int, default=5, help='Versions listed per project')
+    parser.add_argument('--jar-size', type=int, default=32 * 1024, help='Size of every jar, in bytes')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every api response')
+    parser.add_argument('--cdn-latency', type=float, default=0.02, help='Seconds added before every download')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests per window allowed on each api, 0 for no limit')
+    parser.add_argument('--rate-window', type=float, default=60, help='Rate limit window, in seconds')
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    catalog = Catalog(args.mods, libraries=args.libraries, versions=args.versions, jar_size=args.jar_size)
+    server = MockServer(catalog, latency=args.latency, cdn_latency=args.cdn_latency, rate_limit=args.rate_limit, rate_window=args.rate_window)
+
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,247 @@
+# bench.py
+
+"""Offline mcmm benchmark: runs main.main against a local mock of the Modrinth/Curseforge apis (see MockServer.py).
+
+Run from the legacy directory:
+
+    python -m benchmarks.bench --sizes 10 100 1000 5000
+
+Each size gets a fresh mock server and a fresh mcmm process (peak RSS is per process), with empty response cache and id index.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+LEGACY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MOCKED_HOSTS = ('api.modrinth.com', 'api.curseforge.com', 'cdn.modrinth.com', 'edge.forgecdn.net')
+
+
+class LoopbackResolver(aiohttp.abc.AbstractResolver):
+    """Resolves the api and cdn hosts to the mock server, whatever port the url asks for."""
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> list[dict]:
+        if host not in MOCKED_HOSTS:
+            raise OSError(f"{host} is not mocked")
+        return [{'hostname': host, 'host': '127.0.0.1', 'port': self.port, 'family': socket.AF_INET, 'proto': 0, 'flags': socket.AI_NUMERICHOST}]
+
+
+    async def close(self):
+        pass
+
+
+
+def modlist(mods: int, *, curseforge: float, missing: float) -> list[str]:
+    """Urls of mod-0 ... mod-{mods - 1}, a curseforge share of them as Curseforge links, and a missing share replaced by projects that do not exist."""
+    missingCount = round(mods * missing)
+    urls = []
+
+    for i in range(mods):
+        slug = f'missing-{i}' if i >= mods - missingCount else f'mod-{i}'
+        onCurseforge = int((i + 1) * curseforge) > int(i * curseforge)
+        urls.append(f'https://www.curseforge.com/minecraft/mc-mods/{slug}' if onCurseforge else f'https://modrinth.com/mod/{slug}')
+
+    return urls
+
+
+
+def peak_rss() -> int | None:
+    """Peak resident memory of this process in bytes, None where it cannot be read."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+
+def run_scenario(args: argparse.Namespace) -> dict:
+    """Runs main.main once, in this process, against the mock server listening on args.port."""
+    sys.path.insert(0, os.path.join(LEGACY_DIR, 'mcmm')) # main.py imports helpers as a top level module
+
+    from mcmm import main as mcmm_main
+    from mcmm.MCModDownloader import MCModDownloader
+    from mcmm.Crosswalk import Crosswalk
+    from mcmm.ResponseCache import ResponseCache
+    from helpers import cache
+
+    workDir = tempfile.mkdtemp(prefix='mcmm-bench-')
+    try:
+        # Same network configuration as a real run, only the state files are moved out of the config dir
+        client = mcmm_main.build_http_client()
+        client.resolver = LoopbackResolver(args.port)
+        if client.cache is not None and not args.no_cache:
+            client.cache = ResponseCache(os.path.join(workDir, 'responses.sqlite'), max_bytes=client.cache.max_bytes)
+        else:
+            client.cache = None
+        if args.jobs:
+            client.scheduler.configure(workers=args.jobs)
+
+        appCache = cache(os.path.join(workDir, 'cache.json'))
+        appCache.setup()
+
+        crosswalk = Crosswalk(os.path.join(workDir, 'crosswalk.sqlite'))
+        downloader = MCModDownloader(client=client, crosswalk=crosswalk)
+        downloader.modrinth_api.api_url = 'http://api.modrinth.com'
+        downloader.curseforge_api.api_url = 'http://api.curseforge.com'
+
+        mcmm_main.app_cache = appCache
+        mcmm_main._instances.update(http_client=client, crosswalk=crosswalk, downloader=downloader)
+
+        output = os.path.join(workDir, 'output')
+        mainArguments = argparse.Namespace(
+            mod_link=None, mod_list=modlist(args.mods, curseforge=args.curseforge, missing=args.missing),
+            mod_list_txt=None, update=False, install_locked=None,
+            game_version='1.20.1', loader=['fabric'], restrict=None,
+            output=output, resolve=not args.no_resolve
+        )
+
+        client.metrics.start()
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(mcmm_main.with_http_client(mcmm_main.main(mainArguments)))
+        wallTime = time.perf_counter() - started
+
+        summary = client.metrics.summary()
+        modsPath = os.path.join(output, 'mods')
+        return {
+            'mods': args.mods,
+            'wall_time': round(wallTime, 3),
+            'requests': summary['requests'],
+            'retries': summary['retries'],
+            'rate_limit_wait': summary['rate_limit_wait'],
+            'phases': summary['phases'],
+            'jars': len(os.listdir(modsPath)) if os.path.isdir(modsPath) else 0,
+            'peak_rss': peak_rss(),
+            'endpoints': {endpoint: stats['count'] for endpoint, stats in summary['endpoints'].items()}
+        }
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+
+def server_command(args: argparse.Namespace, mods: int) -> list[str]:
+    return [
+        sys.executable, '-m', 'benchmarks.MockServer', '--port', '0', '--mods', str(mods),
+        '--versions', str(args.versions), '--jar-size', str(args.jar_size),
+        '--latency', str(args.latency), '--cdn-latency', str(args.cdn_latency),
+        '--rate-limit', str(args.rate_limit), '--rate-window', str(args.rate_window)
+    ]
+
+
+def scenario_command(args: argparse.Namespace, mods: int, port: int) -> list[str]:
+    command = [
+        sys.executable, '-m', 'benchmarks.bench', '--scenario', '--port', str(port), '--mods', str(mods),
+        '--curseforge', str(args.curseforge), '--missing', str(args.missing), '--jobs', str(args.jobs)
+    ]
+    if args.no_resolve:
+        command.append('--no-resolve')
+    if args.no_cache:
+        command.append('--no-cache')
+    return command
+
+
+
+async def server_stats(port: int) -> dict:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'http://127.0.0.1:{port}/_mock/stats') as response:
+            return await response.json()
+
+
+
+def benchmark(args: argparse.Namespace, mods: int) -> dict:
+    server = subprocess.Popen(server_command(args, mods), cwd=LEGACY_DIR, stdout=subprocess.PIPE, text=True)
+    try:
+        line = server.stdout.readline()
+        if not line.startswith('listening on '):
+            raise RuntimeError(f"Mock server did not start: {line!r}")
+        port = int(line.split()[-1])
+
+        scenario = subprocess.run(scenario_command(args, mods, port), cwd=LEGACY_DIR, stdout=subprocess.PIPE, text=True, check=True)
+        result = json.loads(scenario.stdout.strip().splitlines()[-1])
+        result['server'] = asyncio.run(server_stats(port))
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+
+def report(results: list[dict]):
+    header = f"{'mods':>6} {'wall s':>8} {'requests':>9} {'server':>7} {'429s':>5} {'jars':>6} {'resolve s':>10} {'transfer s':>11} {'wait s':>7} {'MiB':>8} {'peak RSS MiB':>13}"
+    print(header)
+    print('-' * len(header))
+
+    for result in results:
+        rss = f"{result['peak_rss'] / 1024 ** 2:.1f}" if result['peak_rss'] else '-'
+        print(
+            f"{result['mods']:>6} {result['wall_time']:>8.2f} {result['requests']:>9} {result['server']['requests']:>7} "
+            f"{result['server']['statuses'].get('429', 0):>5} {result['jars']:>6} {result['phases']['resolve']:>10.2f} "
+            f"{result['phases']['transfer']:>11.2f} {result['phases']['wait']:>7.2f} {result['server']['bytes'] / 1024 ** 2:>8.1f} {rss:>13}"
+        )
+
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarks mcmm against a local mock of the Modrinth/Curseforge apis')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000], help='Modlist sizes to run')
+    parser.add_argument('--curseforge', type=float, default=0.25, help='Share of the modlist given as Curseforge links')
+    parser.add_argument('--missing', type=float, default=0.01, help='Share of the modlist pointing to projects that do not exist (404s)')
+    parser.add_argument('--versions', type=int, default=5, help='Versions listed per project')
+    parser.add_argument('--jar-size', type=int, default=32 * 1024, help='Size of every jar, in bytes')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every api response')
+    parser.add_argument('--cdn-latency', type=float, default=0.02, help='Seconds added before every download')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests per window allowed on each api, 0 for no limit')
+    parser.add_argument('--rate-window', type=float, default=60, help='Rate limit window, in seconds')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='Worker count, defaults to the workers network config')
+    parser.add_argument('--no-resolve', action='store_true', help='Only detect missing dependencies, do not download them (no -rd)')
+    parser.add_argument('--no-cache', action='store_true', help='Run without the api response cache')
+    parser.add_argument('--output', help='Also write the results to this json file')
+
+    # Internal, a single run in the current process
+    parser.add_argument('--scenario', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--mods', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args)))
+        sys.exit(0)
+
+    results = []
+    for mods in args.sizes:
+        print(f"Running {mods} mods...", flush=True)
+        results.append(benchmark(args, mods))
+
+    print()
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
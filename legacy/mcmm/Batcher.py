@@ -0,0 +1,64 @@
+# Batcher.py
+
+import asyncio
+
+from typing import Awaitable, Callable, Hashable
+
+
+class Batcher:
+    """Coalesces single key lookups into bulk requests.
+
+    Every get() made during the same event loop tick (or during the next `window` seconds) is collected, then
+    fetch_many is called once with all the distinct keys. fetch_many must return a dict of key -> result, keys
+    missing from it resolve to None.
+    """
+
+    def __init__(self, fetch_many: Callable[[list], Awaitable[dict]], *, window: float = 0) -> None:
+        self.fetch_many = fetch_many
+        self.window = window
+
+        self._pending = {}
+        self._scheduled = False
+
+
+    async def get(self, key: Hashable) -> any:
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(key)
+
+        if future is None:
+            future = loop.create_future()
+            self._pending[key] = future
+
+            if not self._scheduled:
+                self._scheduled = True
+                if self.window > 0:
+                    loop.call_later(self.window, self._flush)
+                else:
+                    loop.call_soon(self._flush)
+
+        # Shielded, so one caller giving up does not cancel the lookup for everyone else waiting on the same key
+        return await asyncio.shield(future)
+
+
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._scheduled = False
+
+        if pending:
+            asyncio.ensure_future(self._dispatch(pending))
+
+
+
+    async def _dispatch(self, pending: dict):
+        try:
+            results = await self.fetch_many(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(results.get(key))
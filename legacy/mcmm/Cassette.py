@@ -0,0 +1,331 @@
+# Cassette.py
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+
+from collections import defaultdict, deque
+from typing import Callable
+from urllib.parse import urlsplit
+from multidict import CIMultiDict, CIMultiDictProxy
+
+
+class CassetteMissError(Exception): # A replayed run made a request that was never recorded
+    pass
+
+
+RATE_LIMIT_HEADERS = ('X-Ratelimit-Limit', 'X-Ratelimit-Remaining', 'X-Ratelimit-Reset', 'Retry-After')
+
+
+class BulkEndpoint:
+    """An endpoint looking up many ids at once. The Batchers group ids by timing, so a replay can ask for other groupings
+    than the recorded run did, the items of every recorded response are indexed one by one and reassembled instead.
+
+    Args:
+        ids (Callable): The requested ids, out of the request params and json payload.
+        items (Callable): (ids, item) pairs out of a response body.
+        build (Callable): Response body out of (requested id, item) pairs.
+    """
+
+    def __init__(self, method: str, pattern: str, ids: Callable[[dict, any], list], items: Callable[[any], list[tuple[list, any]]], build: Callable[[list[tuple[str, any]]], any]) -> None:
+        self.method = method
+        self.pattern = pattern
+        self.ids = ids
+        self.items = items
+        self.build = build
+
+
+    def matches(self, method: str, url: str) -> bool:
+        return method.upper() == self.method and re.search(self.pattern, urlsplit(url).path) is not None
+
+
+
+def unique(found: list[tuple[str, dict]]) -> list[dict]:
+    """The items found, once each (a project can be asked for by id and by slug in the same batch)."""
+    return list({item['id']: item for _, item in found}.values())
+
+
+BULK_ENDPOINTS = [
+    BulkEndpoint('GET', r'/v2/(projects|versions)$',
+                 lambda params, payload: json.loads(params['ids']),
+                 lambda body: [([item['id'], item.get('slug')], item) for item in body],
+                 unique),
+    BulkEndpoint('POST', r'/v2/version_files/update$',
+                 lambda params, payload: payload['hashes'],
+                 lambda body: [([hash], version) for hash, version in body.items()],
+                 lambda found: dict(found)),
+    BulkEndpoint('POST', r'/v1/mods$',
+                 lambda params, payload: payload['modIds'],
+                 lambda body: [([item['id']], item) for item in body['data']],
+                 lambda found: {'data': unique(found)}),
+    BulkEndpoint('POST', r'/v1/mods/files$',
+                 lambda params, payload: payload['fileIds'],
+                 lambda body: [([item['id']], item) for item in body['data']],
+                 lambda found: {'data': unique(found)})
+]
+
+
+class ReplayContent:
+    """Stands in for aiohttp's StreamReader, over a body already in memory."""
+
+    def __init__(self, body: bytes, delay: float = 0) -> None:
+        self._body = body
+        self._delay = delay # Transfer time of the body, waited before its first byte is handed out
+        self.total_bytes = 0
+
+
+    async def _wait(self):
+        if self._delay > 0:
+            await asyncio.sleep(self._delay)
+            self._delay = 0
+
+
+    async def iter_chunked(self, n: int):
+        await self._wait()
+        for i in range(0, len(self._body), n):
+            chunk = self._body[i:i + n]
+            self.total_bytes += len(chunk)
+            yield chunk
+
+
+    def iter_any(self):
+        return self.iter_chunked(65536)
+
+
+    async def read(self, n: int = -1) -> bytes:
+        await self._wait()
+        chunk = self._body[self.total_bytes:] if n < 0 else self._body[self.total_bytes:self.total_bytes + n]
+        self.total_bytes += len(chunk)
+        return chunk
+
+
+
+class ReplayResponse:
+    """Stands in for aiohttp's ClientResponse, with the parts of it mcmm reads (status, headers and the body)."""
+
+    def __init__(self, status: int, reason: str, headers: list[list[str]], body: bytes, *, delay: float = 0) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.content = ReplayContent(body, delay)
+
+
+    async def read(self) -> bytes:
+        return await self.content.read()
+
+
+    async def text(self, encoding: str = None) -> str:
+        charset = re.search(r'charset=([\w-]+)', self.headers.get('Content-Type', ''))
+        return (await self.read()).decode(encoding or (charset[1] if charset else 'utf-8'))
+
+
+    async def json(self, **kwargs) -> any:
+        return json.loads(await self.text())
+
+
+
+class Cassette:
+    """Every http request and response of a run, saved to a single file so the run can be replayed offline.
+
+    The file is a zip holding an interactions.jsonl index (request, status, headers and timings of every response) and
+    the bodies under bodies/<sha256>, stored once however many responses share them. Hooked in HttpClient.request, so
+    api calls and downloads are both covered.
+
+    Recording reads each body whole before handing it on, and replay serves a request's responses in the order they were
+    recorded (retries and 429s included), repeating the last one once they run out. Range requests are answered out of the
+    recorded full body, so resumed and segmented downloads replay even if their ranges differ from the recorded run.
+    Bulk lookups are answered out of the recorded items (see BulkEndpoint), ids the recorded run never looked up are
+    answered as not found. With zero_latency, responses are served right away, 429s are skipped and rate limit headers are dropped.
+    """
+
+    INDEX = 'interactions.jsonl'
+
+    def __init__(self, path: str, mode: str, *, zero_latency: bool = False) -> None:
+        self.path = path
+        self.mode = mode
+        self.zero_latency = zero_latency
+        self.started = time.monotonic()
+
+        self._interactions = []
+        self._bodies = set()
+        self._queues = defaultdict(deque)
+        self._items = {} # (bulk endpoint, id) -> item
+        self._bulk_latency = {}
+        self._lock = threading.Lock()
+        self._zip = None
+
+
+    @classmethod
+    def record(cls, path: str) -> 'Cassette':
+        cassette = cls(path, 'record')
+
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, cassette._tempPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        cassette._zip = zipfile.ZipFile(cassette._tempPath, 'w')
+        return cassette
+
+
+    @classmethod
+    def replay(cls, path: str, *, zero_latency: bool = False) -> 'Cassette':
+        cassette = cls(path, 'replay', zero_latency=zero_latency)
+        cassette._zip = zipfile.ZipFile(path, 'r')
+
+        for line in cassette._zip.read(cls.INDEX).decode('utf-8').splitlines():
+            interaction = json.loads(line)
+            if zero_latency and interaction['status'] == 429:
+                continue
+            cassette._queues[interaction['key']].append(interaction)
+            cassette._index_bulk(interaction)
+        return cassette
+
+
+    def _index_bulk(self, interaction: dict):
+        method, url = json.loads(interaction['key'])[:2]
+        endpoint = next((endpoint for endpoint in BULK_ENDPOINTS if endpoint.matches(method, url)), None)
+        if endpoint is None or interaction['status'] != 200:
+            return
+
+        body = json.loads(self._zip.read(f"bodies/{interaction['body']}"))
+        for ids, item in endpoint.items(body):
+            for id in ids:
+                if id is not None:
+                    self._items[(endpoint.pattern, str(id).lower())] = item
+        self._bulk_latency.setdefault(endpoint.pattern, interaction)
+
+
+
+    @staticmethod
+    def key(method: str, url: str, params: dict = None, json: any = None) -> str:
+        """What identifies a request, its headers aside (validators and ranges differ between runs)."""
+        params = sorted((str(key), str(value)) for key, value in (params or {}).items())
+        return json_dumps([method.upper(), url, params, json])
+
+
+    def request(self, session_request, method: str, url: str, **kwargs):
+        """Async context manager giving the response to the request, see HttpClient.request.
+
+        Args:
+            session_request (Callable): The real request function, only called when recording.
+        """
+        if self.mode == 'record':
+            return self._record(session_request, method, url, **kwargs)
+        return self._replay(method, url, **kwargs)
+
+
+
+    @contextlib.asynccontextmanager
+    async def _record(self, session_request, method: str, url: str, **kwargs):
+        began = time.monotonic()
+        async with session_request(method, url, **kwargs) as response:
+            latency = time.monotonic() - began
+            body = await response.read()
+            duration = time.monotonic() - began
+            status, reason, headers = response.status, response.reason, [[key, value] for key, value in response.headers.items()]
+
+        digest = hashlib.sha256(body).hexdigest()
+        await asyncio.to_thread(self._store, digest, body, headers)
+
+        self._interactions.append({
+            'key': self.key(method, url, kwargs.get('params'), kwargs.get('json')),
+            'range': (kwargs.get('headers') or {}).get('Range'),
+            'status': status,
+            'reason': reason,
+            'headers': headers,
+            'body': digest,
+            'start': round(began - self.started, 4),
+            'latency': round(latency, 4),
+            'duration': round(duration, 4)
+        })
+
+        yield ReplayResponse(status, reason, headers, body)
+
+
+    def _store(self, digest: str, body: bytes, headers: list[list[str]]):
+        with self._lock:
+            if digest in self._bodies:
+                return
+            self._bodies.add(digest)
+
+            # Api responses compress well, jars are zips already
+            compressible = any(key.lower() == 'content-type' and ('json' in value or 'text' in value) for key, value in headers)
+            self._zip.writestr(f'bodies/{digest}', body, compress_type=zipfile.ZIP_DEFLATED if compressible else zipfile.ZIP_STORED)
+
+
+
+    @contextlib.asynccontextmanager
+    async def _replay(self, method: str, url: str, *, headers: dict = None, params: dict = None, json: any = None, **kwargs):
+        queue = self._queues.get(self.key(method, url, params, json))
+        bulk = next((endpoint for endpoint in BULK_ENDPOINTS if endpoint.matches(method, url)), None)
+        
+        if queue:
+            interaction = queue.popleft() if len(queue) > 1 else queue[0]
+            body = await asyncio.to_thread(self._zip.read, f"bodies/{interaction['body']}")
+            status, reason, responseHeaders = interaction['status'], interaction['reason'], interaction['headers']
+        
+        elif bulk is not None and bulk.pattern in self._bulk_latency:
+            # Timed like the first recorded response of the endpoint
+            interaction = self._bulk_latency[bulk.pattern]
+            found = [(id, self._items[(bulk.pattern, str(id).lower())]) for id in bulk.ids(params or {}, json) if (bulk.pattern, str(id).lower()) in self._items]
+            body = json_dumps(bulk.build(found)).encode('utf-8')
+            status, reason, responseHeaders = 200, 'OK', [['Content-Type', 'application/json']]
+        
+        else:
+            raise CassetteMissError(f"{method} {url} is not in the cassette {self.path}")
+
+        requested = (headers or {}).get('Range')
+        if requested and status == 200:
+            status, responseHeaders, body = self._slice(requested, (headers or {}).get('If-Range'), responseHeaders, body)
+
+        if self.zero_latency:
+            responseHeaders = [[key, value] for key, value in responseHeaders if key.title() not in RATE_LIMIT_HEADERS]
+        else:
+            await asyncio.sleep(interaction['latency'])
+
+        delay = 0 if self.zero_latency else max(interaction['duration'] - interaction['latency'], 0)
+        yield ReplayResponse(status, reason, responseHeaders, body, delay=delay)
+
+
+    @staticmethod
+    def _slice(requested: str, ifRange: str | None, headers: list[list[str]], body: bytes) -> tuple[int, list[list[str]], bytes]:
+        """Answers a Range request out of a recorded full (200) response, the way a server would."""
+        etag = next((value for key, value in headers if key.lower() == 'etag'), None)
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', requested)
+        if match is None or (ifRange is not None and ifRange != etag) or int(match[1]) >= len(body):
+            return 200, headers, body
+
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else len(body) - 1, len(body) - 1)
+        headers = [[key, value] for key, value in headers if key.lower() not in ('content-length', 'content-range')]
+        headers += [['Content-Range', f'bytes {start}-{end}/{len(body)}'], ['Content-Length', str(end - start + 1)]]
+        return 206, headers, body[start:end + 1]
+
+
+
+    def close(self):
+        """Writes the index and moves the recording in place (or just closes a replayed cassette)."""
+        if self._zip is None:
+            return
+
+        if self.mode == 'record':
+            index = ''.join(json_dumps(interaction) + '\n' for interaction in self._interactions)
+            self._zip.writestr(self.INDEX, index, compress_type=zipfile.ZIP_DEFLATED)
+            self._zip.close()
+            os.replace(self._tempPath, self.path)
+        else:
+            self._zip.close()
+
+        self._zip = None
+
+
+
+def json_dumps(value: any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
@@ -0,0 +1,159 @@
+# Crosswalk.py
+
+import csv
+import json
+import os
+import sqlite3
+import time
+
+
+class Crosswalk:
+    """Persistent modrinth id <-> curseforge id <-> slug index, stored in a SQLite database.
+
+    Filled by MCM_Utils.get_equivalent_ids as lookups happen, and can be bulk imported from a json/csv file.
+    The whole index is loaded into two dicts on first use, so lookups are O(1) and cost no request at all.
+    Entries missing one of the sides (the mod is only on one platform, as far as we know) expire after partial_ttl,
+    so a mod that gets published on the other platform later is eventually picked up.
+    """
+
+    PARTIAL_TTL = 7 * 24 * 3600
+
+    def __init__(self, path: str, *, partial_ttl: float = PARTIAL_TTL) -> None:
+        self.path = path
+        self.partial_ttl = partial_ttl
+
+        self._db = None
+        self._by_modrinth = None
+        self._by_curseforge = None
+
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS crosswalk (
+                    modrinth_id TEXT UNIQUE,
+                    curseforge_id INTEGER UNIQUE,
+                    slug TEXT,
+                    updated REAL
+                )""")
+        return self._db
+
+
+
+    def _load(self):
+        if self._by_modrinth is not None:
+            return
+
+        self._by_modrinth = {}
+        self._by_curseforge = {}
+        for row in self.db.execute('SELECT modrinth_id, curseforge_id, slug, updated FROM crosswalk'):
+            self._index(row)
+
+
+    def _index(self, row: tuple):
+        modrinth_id, curseforge_id = row[0], row[1]
+        if modrinth_id is not None:
+            self._by_modrinth[modrinth_id] = row
+        if curseforge_id is not None:
+            self._by_curseforge[curseforge_id] = row
+
+
+
+    def lookup(self, *, modrinth_id: str = None, curseforge_id: int = None) -> tuple[str | None, int | None] | None:
+        """(modrinth id, curseforge id) of the given project, None if it is not indexed (or its partial entry expired).
+        """
+        self._load()
+
+        row = self._by_modrinth.get(modrinth_id) if modrinth_id is not None else self._by_curseforge.get(int(curseforge_id))
+        if row is None:
+            return None
+
+        partial = row[0] is None or row[1] is None
+        if partial and time.time() - row[3] >= self.partial_ttl:
+            return None
+
+        return row[0], row[1]
+
+
+    def slug(self, *, modrinth_id: str = None, curseforge_id: int = None) -> str | None:
+        self._load()
+
+        row = self._by_modrinth.get(modrinth_id) if modrinth_id is not None else self._by_curseforge.get(int(curseforge_id))
+        return row[2] if row else None
+
+
+
+    def record(self, modrinth_id: str | None, curseforge_id: int | None, slug: str = None):
+        self.bulk_import([{'modrinth_id': modrinth_id, 'curseforge_id': curseforge_id, 'slug': slug}])
+
+
+    def bulk_import(self, entries: list[dict]) -> int:
+        """Adds or replaces many entries in a single transaction.
+
+        Args:
+            entries (list[dict]): Each with 'modrinth_id' and/or 'curseforge_id', and optionally 'slug'.
+
+        Returns:
+            int: How many entries were imported.
+        """
+        self._load()
+        now = time.time()
+        rows = []
+
+        for entry in entries:
+            modrinth_id = entry.get('modrinth_id') or None
+            curseforge_id = int(entry['curseforge_id']) if entry.get('curseforge_id') else None
+            if modrinth_id is None and curseforge_id is None:
+                continue
+            rows.append((modrinth_id, curseforge_id, entry.get('slug') or None, now))
+
+        # Entries sharing an id would break the UNIQUE columns, the last one wins like it does against stored entries
+        byModrinth, byCurseforge = {}, {}
+        for row in rows:
+            for stale in (byModrinth.get(row[0]), byCurseforge.get(row[1])):
+                if stale is not None:
+                    byModrinth.pop(stale[0], None)
+                    byCurseforge.pop(stale[1], None)
+            if row[0] is not None:
+                byModrinth[row[0]] = row
+            if row[1] is not None:
+                byCurseforge[row[1]] = row
+        rows = list({id(row): row for row in [*byModrinth.values(), *byCurseforge.values()]}.values())
+
+        with self.db:
+            # An id can only belong to one entry, the older entries holding either id are replaced
+            self.db.executemany('DELETE FROM crosswalk WHERE modrinth_id = ? OR curseforge_id = ?', [row[:2] for row in rows])
+            self.db.executemany('INSERT INTO crosswalk VALUES (?, ?, ?, ?)', rows)
+
+        for row in rows:
+            for stale in (self._by_modrinth.get(row[0]), self._by_curseforge.get(row[1])):
+                if stale is not None:
+                    self._by_modrinth.pop(stale[0], None)
+                    self._by_curseforge.pop(stale[1], None)
+            self._index(row)
+
+        return len(rows)
+
+
+    def import_file(self, path: str) -> int:
+        """Bulk imports a .json (list of entries) or .csv (with a modrinth_id,curseforge_id,slug header) file, see bulk_import."""
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.csv'):
+                entries = list(csv.DictReader(f))
+            else:
+                entries = json.load(f)
+
+        return self.bulk_import(entries)
+
+
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
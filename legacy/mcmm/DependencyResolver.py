@@ -0,0 +1,127 @@
+# DependencyResolver.py
+
+import asyncio
+
+from mcmm.MCModDownloader import MCModDownloader
+
+
+class DependencyResolver:
+    """Finds, and optionally downloads, the required dependencies that are not installed yet.
+
+    The dependency graph is walked breadth first. Every dependency of a level is looked up at the same time, so the
+    API batchers merge the project lookups into a few bulk requests, and the downloads of the level go through the
+    scheduler worker pool. The dependencies of every new download make up the next level, until nothing is missing.
+    Dependencies are compared by their (modrinth id, curseforge id) pair, so a mod installed from either platform counts.
+    """
+
+    def __init__(self, downloader: MCModDownloader, *, prioritize_cf: bool = False, blacklist: set = None) -> None:
+        self.downloader = downloader
+        self.utils = downloader.utils
+        self.prioritize_cf = prioritize_cf
+        self.blacklist = blacklist or set()
+
+
+
+    @staticmethod
+    def required(dependencyList: list[dict]) -> list[dict]:
+        """The required dependencies out of the {'data', 'host'} dependency lists the download modes return, without duplicates.
+        """
+        seen = set()
+        required = []
+
+        for dep in dependencyList:
+            for data in dep['data']:
+                if dep['host'] == 'www.curseforge.com' and data['relationType'] == 3:
+                    key = data['modId']
+                elif dep['host'] == 'modrinth.com' and data['dependency_type'] == 'required' and data.get('project_id'):
+                    key = data['project_id']
+                else:
+                    continue
+
+                if key not in seen:
+                    seen.add(key)
+                    required.append(data)
+
+        return required
+
+
+
+    async def equivalents(self, dependencies: list[dict]) -> list[tuple[str | None, int | None]]:
+        """(modrinth id, curseforge id) of every dependency, the ones that could not be looked up are left out.
+        """
+        async def lookup(dependency: dict):
+            try:
+                return await self.utils.get_equivalent_ids(dependency)
+            except Exception as e:
+                print(f"Error looking up dependency {dependency.get('project_id') or dependency.get('modId')}: {e}")
+                return None
+
+        # Gathered, not mapped over the worker pool, so every lookup of the level is issued in the same tick and batched
+        results = await asyncio.gather(*(lookup(dependency) for dependency in dependencies))
+        return [ids for ids in results if ids is not None]
+
+
+
+    def missing(self, equivalents: list[tuple[str | None, int | None]], installed: set) -> list[tuple[str | None, int | None]]:
+        """The dependencies that are neither installed nor blacklisted, without duplicates."""
+        missing = []
+        seen = set()
+
+        for ids in equivalents:
+            known = [id for id in ids if id is not None]
+            if any(id in installed or id in self.blacklist or id in seen for id in known):
+                continue
+
+            seen.update(known)
+            missing.append(ids)
+
+        return missing
+
+
+
+    async def download(self, missing: list[tuple[str | None, int | None]], installed: set, parameters: dict, output: str) -> tuple[list[str], list[str], list[tuple[str | None, int | None]]]:
+        """Downloads the missing dependencies, then the missing dependencies of those, level by level.
+
+        Args:
+            missing (list[tuple]): First level, as returned by missing.
+            installed (set): Ids (of either platform) already installed, updated as dependencies get downloaded.
+
+        Returns:
+            tuple[list[str], list[str], list[tuple]]: The successful and failed download results, and the dependencies that could not be downloaded.
+        """
+        successful = []
+        failed = []
+        unresolved = []
+
+        level = missing
+        depth = 1
+        claimed = set(installed) # Installed or already attempted, so a dependency shared by several mods is only tried once
+
+        while len(level) > 0:
+            print(f"Resolving {len(level)} missing dependencies (level {depth})")
+
+            for ids in level:
+                claimed.update(id for id in ids if id is not None)
+
+            results = await self.downloader.client.scheduler.map(
+                lambda ids: self.downloader.download_dependency(ids, parameters, output, prioritize_cf=self.prioritize_cf),
+                level
+            )
+
+            dependencyList = []
+            for ids, (failedStatus, result, dlid, dpid) in zip(level, results):
+                if failedStatus:
+                    failed.append(result)
+                    unresolved.append(ids)
+                    continue
+
+                successful.append(result)
+                installed.update(id for id in ids if id is not None)
+                installed.add(dlid['data'])
+                if dpid:
+                    dependencyList.append(dpid)
+
+            level = self.missing(await self.equivalents(self.required(dependencyList)), claimed)
+            depth += 1
+
+        return successful, failed, unresolved
@@ -0,0 +1,90 @@
+# Fingerprint.py
+
+import asyncio
+import os
+import struct
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import murmurhash2 # Optional, hashes in C
+except ImportError:
+    murmurhash2 = None
+
+
+WHITESPACE = b'\t\n\r '
+MURMUR_M = 0x5bd1e995
+MASK = 0xFFFFFFFF
+
+
+def curseforge_fingerprint(path: str, *, chunk_size: int = 1024 * 1024) -> int:
+    """Curseforge file fingerprint: 32 bit MurmurHash2 (seed 1) of the file with every whitespace byte removed.
+
+    With the murmurhash2 package installed the whole file is hashed in C. Otherwise it is streamed in chunks (twice,
+    murmur2 needs the final length before hashing), so memory use stays the same whatever the size of the jar.
+    Blocking and CPU bound, use fingerprint_files to spread it over processes.
+    """
+    if murmurhash2 is not None:
+        with open(path, 'rb') as f:
+            return murmurhash2.murmurhash2(f.read().translate(None, WHITESPACE), 1)
+
+    length = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            length += len(chunk.translate(None, WHITESPACE))
+
+    m = MURMUR_M
+    h = (1 ^ length) & MASK
+    rest = b''
+
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            data = rest + chunk.translate(None, WHITESPACE)
+            words = len(data) // 4
+            rest = data[words * 4:]
+
+            for k in mix_words(data, words):
+                h = ((h * m) & MASK) ^ k
+
+    if rest:
+        for shift, byte in enumerate(rest):
+            h ^= byte << (8 * shift)
+        h = (h * m) & MASK
+
+    h ^= h >> 13
+    h = (h * m) & MASK
+    h ^= h >> 15
+    return h
+
+
+
+def mix_words(data: bytes, words: int) -> tuple[int, ...]:
+    """The murmur2 mix of the first words 32 bit words of data, done for all of them at once.
+
+    Each word gets a 64 bit lane of one big integer, so the multiplications never carry into the next lane and the
+    whole mix runs as a handful of big integer operations instead of a Python loop per word.
+    """
+    lanes = int.from_bytes(struct.pack(f'<{words}Q', *struct.unpack_from(f'<{words}I', data)), 'little')
+    laneMask = int.from_bytes(b'\xff\xff\xff\xff\x00\x00\x00\x00' * words, 'little')
+
+    lanes = (lanes * MURMUR_M) & laneMask
+    lanes = (lanes ^ (lanes >> 24)) & laneMask
+    lanes = (lanes * MURMUR_M) & laneMask
+    return struct.unpack(f'<{words}Q', lanes.to_bytes(words * 8, 'little'))
+
+
+
+async def fingerprint_files(paths: list[str], *, workers: int = None) -> list[int]:
+    """Fingerprints every file on a process pool.
+
+    Returns:
+        list[int]: The fingerprints, in the same order as paths.
+    """
+    if len(paths) == 0:
+        return []
+
+    loop = asyncio.get_running_loop()
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return await asyncio.gather(*(loop.run_in_executor(pool, curseforge_fingerprint, path) for path in paths))
@@ -0,0 +1,132 @@
+# HttpClient.py
+
+import asyncio
+import re
+import aiohttp
+
+from urllib.parse import urlsplit
+
+from mcmm.Scheduler import Scheduler
+from mcmm.RateLimiter import RateLimiter
+from mcmm.RetryPolicy import RetryPolicy
+from mcmm.Memo import SingleFlight
+from mcmm.Metrics import Metrics
+from mcmm.Cassette import Cassette
+
+
+ENDPOINT_CLASSES = [
+    (r'/v2/project/[^/]+/version$', 'versions'),
+    (r'/v2/(project/[^/]+|projects)$', 'project'),
+    (r'/v2/(version/[^/]+|versions)$', 'version'),
+    (r'/v2/version_files?/', 'hashes'),
+    (r'/v1/mods/search$', 'search'),
+    (r'/v1/mods/[^/]+/files/[^/]+$', 'file'),
+    (r'/v1/mods/[^/]+/files$', 'files'),
+    (r'/v1/mods/files$', 'file'),
+    (r'/v1/mods(/[^/]+)?$', 'project'),
+    (r'/v1/games$', 'games'),
+    (r'/v1/fingerprints', 'fingerprints')
+]
+
+
+def endpoint_class(url: str) -> str:
+    """Groups an url into a broad kind of endpoint (project, versions, search...), used for cache TTLs and stats.
+    Anything that is not a known api endpoint is considered a file download.
+    """
+    path = urlsplit(url).path.rstrip('/')
+    
+    for pattern, name in ENDPOINT_CLASSES:
+        if re.search(pattern, path):
+            return name
+    return 'download'
+
+
+class HttpClient:
+    """Long lived, pooled http client shared by every API object of a run.
+
+    The underlying aiohttp session is created lazily on first use (it must be created inside a running event loop)
+    and is reused for every request, so connections are kept alive and DNS lookups are cached between calls.
+    """
+
+    _default = None
+
+    def __init__(self, *, timeout: float = 60, connect_timeout: float = 15, connections: int = 100, connections_per_host: int = 16, dns_cache_ttl: int = 300, keepalive_timeout: float = 30, segment_threshold: int = 64 * 1024 * 1024, segment_connections: int = 4, resolver: aiohttp.abc.AbstractResolver = None, cassette: Cassette = None, scheduler: Scheduler = None, cache: object = None, rate_limiter: RateLimiter = None, retry_policy: RetryPolicy = None, metrics: Metrics = None) -> None:
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.segment_threshold = segment_threshold # Files at least this big (in bytes) are downloaded in segments, see utils.Dl_Segmented
+        self.segment_connections = segment_connections
+        self.resolver = resolver # Custom dns resolution, the benchmarks point the real hosts at a local mock server with it
+        self.cassette = cassette # Records every request, or replays a recording instead of touching the network
+        self.scheduler = scheduler or Scheduler()
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or Metrics()
+        self.inflight = SingleFlight() # Shared by every API object, identical concurrent GETs become one request
+
+        self._session = None
+        self._loop = None
+
+
+    @classmethod
+    def default(cls) -> 'HttpClient':
+        """Returns the process wide client, used by API objects that were not given one explicitly."""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.connections,
+                limit_per_host=self.connections_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+                resolver=self.resolver
+            )
+
+            # No total timeout, a big jar can legitimately take minutes, only stalled reads are cut
+            timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.timeout)
+
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._loop = loop
+
+        return self._session
+
+
+
+    def request(self, method: str, url: str, **kwargs):
+        """Same as aiohttp.ClientSession.request, but on the shared pooled session (or through the cassette, see Cassette)."""
+        if self.cassette is not None:
+            return self.cassette.request(lambda *args, **options: self.session.request(*args, **options), method, url, **kwargs)
+        return self.session.request(method, url, **kwargs)
+
+
+
+    async def close(self):
+        """Closes the pooled session (and the response cache), both are reopened if the client is used again."""
+        if self.cache is not None:
+            self.cache.close()
+            
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+
+        self._session = None
+        self._loop = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,312 @@
+# JarInspector.py
+
+import asyncio
+import json
+import mmap
+import os
+import re
+import struct
+import tomllib
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+METADATA_FILES = {
+    'fabric': 'fabric.mod.json',
+    'quilt': 'quilt.mod.json',
+    'forge': 'META-INF/mods.toml',
+    'neoforge': 'META-INF/neoforge.mods.toml'
+}
+MANIFEST = 'META-INF/MANIFEST.MF'
+JARJAR_METADATA = 'META-INF/jarjar/metadata.json'
+
+# Provided by the game or the loader itself, never missing
+PLATFORM_IDS = {'minecraft', 'java', 'fabricloader', 'fabric-loader', 'quilt_loader', 'forge', 'neoforge', 'fml', 'javafml'}
+
+EOCD = struct.Struct('<4sHHHHIIH')
+ZIP64_LOCATOR = struct.Struct('<4sIQI')
+ZIP64_EOCD = struct.Struct('<4sQHHIIQQQQ')
+CENTRAL_ENTRY = struct.Struct('<4sHHHHHHIIIHHHHHII')
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+
+class ZipIndex:
+    """The central directory of a zip held in a buffer (an mmap of the jar, or a nested jar), and reads of single members.
+
+    Only the end of the file, the central directory and the members actually read are touched, so with an mmap
+    the rest of the jar (classes, assets) is never read from disk.
+    """
+
+    def __init__(self, buffer) -> None:
+        self.buffer = buffer
+        self.entries = {} # name -> (local header offset, compressed size, method, flags)
+
+        end = buffer.rfind(b'PK\x05\x06', max(0, len(buffer) - EOCD.size - 65535))
+        if end < 0:
+            raise ValueError("Not a zip file")
+
+        _, _, _, _, count, size, offset, _ = EOCD.unpack_from(buffer, end)
+        if count == 0xFFFF or offset == 0xFFFFFFFF:
+            count, offset = self._zip64(end)
+
+        position = offset
+        for _ in range(count):
+            (signature, _, _, flags, method, _, _, _, compressed, _, nameLength, extraLength, commentLength, _, _, _, local) = CENTRAL_ENTRY.unpack_from(buffer, position)
+            if signature != b'PK\x01\x02':
+                raise ValueError("Corrupt central directory")
+
+            rawName = bytes(buffer[position + CENTRAL_ENTRY.size:position + CENTRAL_ENTRY.size + nameLength])
+            name = rawName.decode('utf-8' if flags & 0x800 else 'cp437')
+            self.entries[name] = (local, compressed, method, flags)
+            position += CENTRAL_ENTRY.size + nameLength + extraLength + commentLength
+
+
+    def _zip64(self, end: int) -> tuple[int, int]:
+        signature, _, recordOffset, _ = ZIP64_LOCATOR.unpack_from(self.buffer, end - ZIP64_LOCATOR.size)
+        if signature != b'PK\x06\x07':
+            raise ValueError("Corrupt zip64 end of central directory")
+
+        _, _, _, _, _, _, _, count, _, offset = ZIP64_EOCD.unpack_from(self.buffer, recordOffset)
+        return count, offset
+
+
+
+    def read(self, name: str) -> bytes | None:
+        """The uncompressed member, None if it is not in the zip (or can not be read: encrypted, zip64 sized, unknown method)."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+
+        local, compressed, method, flags = entry
+        if flags & 0x1 or compressed == 0xFFFFFFFF:
+            return None
+
+        _, _, _, _, _, _, _, _, _, nameLength, extraLength = LOCAL_HEADER.unpack_from(self.buffer, local)
+        start = local + LOCAL_HEADER.size + nameLength + extraLength
+        data = self.buffer[start:start + compressed]
+
+        if method == 0:
+            return bytes(data)
+        if method == 8:
+            return zlib.decompress(data, -15)
+        return None
+
+
+
+def inspect_jar(path: str) -> dict:
+    """Reads the mods a jar holds out of its metadata files, without any api call.
+
+    Returns:
+        dict: 'file', and 'mods' (see read_mods), or 'error' if the jar could not be read.
+    """
+    result = {'file': os.path.basename(path), 'mods': []}
+
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            result['mods'] = read_mods(ZipIndex(buffer))
+    except (OSError, ValueError, struct.error, zlib.error) as e: # mmap of an empty file raises ValueError too
+        result['error'] = str(e) or type(e).__name__
+
+    return result
+
+
+def read_mods(zip: ZipIndex, *, bundled: bool = False, depth: int = 0) -> list[dict]:
+    """Every mod declared in the zip, and in the jars nested in it (jar-in-jar), those marked as bundled.
+
+    Each mod is a dict with 'id', 'name', 'version', 'loader', 'provides' (other ids it satisfies), 'bundled' and
+    'dependencies', a list of {'ids' (any of them satisfies it), 'version' (range, as declared), 'required'}.
+    """
+    mods = []
+    manifest = None
+
+    for loader, name in METADATA_FILES.items():
+        data = zip.read(name)
+        if data is None:
+            continue
+
+        text = data.decode('utf-8-sig', errors='replace')
+        try:
+            match loader:
+                case 'fabric':
+                    mods += [fabric_mod(json.loads(text, strict=False))]
+                case 'quilt':
+                    mods += [quilt_mod(json.loads(text, strict=False))]
+                case _:
+                    if manifest is None:
+                        manifest = parse_manifest(zip.read(MANIFEST))
+                    mods += toml_mods(tomllib.loads(text), loader, manifest)
+        except (ValueError, KeyError, TypeError, AttributeError): # Broken metadata, the other files may still be fine
+            continue
+
+    for mod in mods:
+        mod['bundled'] = bundled
+
+    # Nested jars are small and usually stored uncompressed, they are copied out and indexed like the outer one
+    if depth < 2:
+        for nestedName in nested_jars(zip):
+            nested = zip.read(nestedName)
+            if nested is None:
+                continue
+            try:
+                mods += read_mods(ZipIndex(nested), bundled=True, depth=depth + 1)
+            except (ValueError, struct.error, zlib.error):
+                continue
+
+    return mods
+
+
+
+def fabric_mod(data: dict) -> dict:
+    dependencies = []
+    for field, required in (('depends', True), ('recommends', False)):
+        for id, version in (data.get(field) or {}).items():
+            dependencies.append({'ids': [id], 'version': version, 'required': required})
+
+    return {
+        'id': data['id'],
+        'name': data.get('name') or data['id'],
+        'version': data.get('version'),
+        'loader': 'fabric',
+        'provides': list(data.get('provides') or []),
+        'dependencies': dependencies
+    }
+
+
+def quilt_mod(data: dict) -> dict:
+    loader = data['quilt_loader']
+
+    def dependency(entry: str | dict | list) -> dict:
+        if isinstance(entry, str):
+            return {'ids': [entry], 'version': '*', 'required': True}
+        if isinstance(entry, list): # Any of them
+            alternatives = [dependency(item) for item in entry]
+            return {'ids': [id for item in alternatives for id in item['ids']], 'version': '*', 'required': all(item['required'] for item in alternatives)}
+        return {'ids': [entry['id'].split(':')[-1]], 'version': entry.get('versions', '*'), 'required': not entry.get('optional', False)}
+
+    return {
+        'id': loader['id'],
+        'name': (loader.get('metadata') or {}).get('name') or loader['id'],
+        'version': loader.get('version'),
+        'loader': 'quilt',
+        'provides': [entry if isinstance(entry, str) else entry['id'] for entry in loader.get('provides') or []],
+        'dependencies': [dependency(entry) for entry in loader.get('depends') or []]
+    }
+
+
+def toml_mods(data: dict, loader: str, manifest: dict) -> list[dict]:
+    """Mods of a (neo)forge mods.toml, dependencies being listed per mod id under [[dependencies.<modid>]]."""
+    mods = []
+    dependencyTables = data.get('dependencies') or {}
+
+    for mod in data.get('mods') or []:
+        version = str(mod.get('version', ''))
+        if '${file.jarVersion}' in version:
+            version = version.replace('${file.jarVersion}', manifest.get('Implementation-Version', '?'))
+
+        dependencies = []
+        for dependency in dependencyTables.get(mod['modId']) or []:
+            # Forge says mandatory=true, newer neoforge says type="required"
+            required = dependency.get('mandatory', str(dependency.get('type', 'required')).lower() == 'required')
+            dependencies.append({'ids': [dependency['modId']], 'version': dependency.get('versionRange', '*'), 'required': bool(required)})
+
+        mods.append({
+            'id': mod['modId'],
+            'name': mod.get('displayName') or mod['modId'],
+            'version': version or None,
+            'loader': loader,
+            'provides': [],
+            'dependencies': dependencies
+        })
+
+    return mods
+
+
+def parse_manifest(data: bytes | None) -> dict:
+    if data is None:
+        return {}
+
+    # Long values are continued on lines starting with a space
+    text = re.sub(r'\r?\n ', '', data.decode('utf-8', errors='replace'))
+    return dict(line.split(': ', 1) for line in text.splitlines() if ': ' in line)
+
+
+def nested_jars(zip: ZipIndex) -> list[str]:
+    """The jars nested in the zip, as listed by fabric/quilt metadata and forge's jarjar metadata."""
+    names = []
+
+    for metadata in (METADATA_FILES['fabric'], METADATA_FILES['quilt']):
+        data = zip.read(metadata)
+        if data is None:
+            continue
+        try:
+            parsed = json.loads(data.decode('utf-8-sig', errors='replace'), strict=False)
+        except ValueError:
+            continue
+        entries = parsed.get('jars') or (parsed.get('quilt_loader') or {}).get('jars') or []
+        names += [entry['file'] if isinstance(entry, dict) else entry for entry in entries]
+
+    data = zip.read(JARJAR_METADATA)
+    if data is not None:
+        try:
+            names += [entry['path'] for entry in json.loads(data).get('jars') or []]
+        except (ValueError, KeyError):
+            pass
+
+    return list(dict.fromkeys(name for name in names if name in zip.entries))
+
+
+
+def _inspect_batch(paths: list[str]) -> list[dict]:
+    return [inspect_jar(path) for path in paths]
+
+
+async def inspect_jars(paths: list[str], *, workers: int = None, pool_threshold: int = 64, batch_size: int = 16) -> list[dict]:
+    """Inspects every jar (see inspect_jar), on a process pool once there are enough of them to pay for starting it.
+
+    Returns:
+        list[dict]: The results, in the same order as paths.
+    """
+    if len(paths) == 0:
+        return []
+
+    if len(paths) < pool_threshold:
+        return await asyncio.to_thread(_inspect_batch, paths)
+
+    loop = asyncio.get_running_loop()
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    workers = min(workers or os.cpu_count() or 1, len(batches))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = await asyncio.gather(*(loop.run_in_executor(pool, _inspect_batch, batch) for batch in batches))
+    return [result for batch in results for result in batch]
+
+
+
+def installed_ids(jars: list[dict]) -> set[str]:
+    """Every mod id the inspected jars satisfy, bundled mods and provided ids included."""
+    ids = set()
+    for jar in jars:
+        for mod in jar['mods']:
+            ids.add(mod['id'])
+            ids.update(mod['provides'])
+    return ids
+
+
+def missing_dependencies(jars: list[dict]) -> dict[str, list[str]]:
+    """The required dependencies none of the jars satisfies, mapped to the (names of the) mods requiring them.
+    """
+    installed = installed_ids(jars) | PLATFORM_IDS
+    missing = {}
+
+    for jar in jars:
+        for mod in jar['mods']:
+            for dependency in mod['dependencies']:
+                if not dependency['required'] or any(id in installed for id in dependency['ids']):
+                    continue
+
+                requiredBy = missing.setdefault(' | '.join(dependency['ids']), [])
+                if mod['name'] not in requiredBy:
+                    requiredBy.append(mod['name'])
+
+    return missing
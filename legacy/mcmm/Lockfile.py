@@ -0,0 +1,79 @@
+# Lockfile.py
+
+import json
+import os
+import tempfile
+
+from mcmm.helpers import file_matches
+
+
+LOCKFILE_NAME = 'mcmm.lock'
+
+
+class Lockfile:
+    """The exact files a run resolved, saved as mcmm.lock in the output directory.
+
+    Each entry records the platform, project id, version/file id, file name, download url, size and hashes, which is
+    everything needed to download the same files again without a single api call (see MCModDownloader.install_locked).
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, entries: list[dict] = None) -> None:
+        self.path = path
+        self.entries = {}
+
+        for entry in entries or []:
+            self.add(entry)
+
+
+    @classmethod
+    def load(cls, path: str) -> 'Lockfile':
+        """Reads the lockfile at path, an empty one if it does not exist yet.
+
+        Raises:
+            OSError: The lockfile could not be read.
+            ValueError: It is not a lockfile (malformed json or entries) or of an unsupported version.
+        """
+        if not os.path.exists(path):
+            return cls(path)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if not isinstance(data, dict) or data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported lockfile version: {data.get('version') if isinstance(data, dict) else None}")
+
+        try:
+            return cls(path, data['entries'])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Malformed lockfile entries ({type(e).__name__}: {e})") from e
+
+
+
+    def add(self, entry: dict):
+        """Adds an entry, replacing the previous entry of the same project."""
+        self.entries[(entry['platform'], str(entry['project_id']))] = entry
+
+
+    def save(self, mods_path: str):
+        """Writes the lockfile, leaving out the entries whose file is no longer in mods_path (removed or replaced by an update)."""
+        entries = sorted(
+            (entry for entry in self.entries.values() if os.path.exists(os.path.join(mods_path, entry['filename']))),
+            key=lambda entry: entry['filename'].lower()
+        )
+
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tempPath = tempfile.mkstemp(dir=directory, suffix='.lock')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': entries}, f, indent=2)
+        os.replace(tempPath, self.path)
+
+
+
+    @staticmethod
+    def matches(entry: dict, path: str) -> bool:
+        """Whether the file at path is the one the entry describes. Blocking, run it in a thread from async code."""
+        return file_matches(path, entry.get('size'), entry.get('hashes'))
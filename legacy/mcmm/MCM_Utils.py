@@ -4,17 +4,29 @@ from typing import Literal
 from furl import furl
 
 from mcmm.MCSiteAPI import ModrinthAPI, CurseforgeAPI
+from mcmm.HttpClient import HttpClient
+from mcmm.Crosswalk import Crosswalk
 
 class MCM_Utils:
-    def __init__(self):
-        self.modrinth_api = ModrinthAPI()
-        self.curseforge_api = CurseforgeAPI()
+    def __init__(self, *, client: HttpClient = None, modrinth_api: ModrinthAPI = None, curseforge_api: CurseforgeAPI = None, crosswalk: Crosswalk = None):
+        self.modrinth_api = modrinth_api or ModrinthAPI(client=client)
+        self.curseforge_api = curseforge_api or CurseforgeAPI(client=client)
+        self.crosswalk = crosswalk # Optional persistent id index, skips the lookups below for projects already mapped
 
 
 
     async def get_equivalent_ids(self, id: dict) -> tuple[str, int]:
         CFId = MDId = None
         
+        if self.crosswalk is not None:
+            known = (
+                self.crosswalk.lookup(curseforge_id=id['modId'])
+                if id.get('modId') is not None else
+                self.crosswalk.lookup(modrinth_id=id['project_id'])
+                )
+            if known is not None:
+                return known
+        
         if id.get('modId') is not None:
             CFId = id['modId']
             project = await self.curseforge_api.get_project_by_id(CFId)
@@ -25,8 +37,11 @@ class MCM_Utils:
         else:
             MDId = id['project_id']
             project = await self.modrinth_api.get_project_by_id(MDId)
-            if project.get('slug'):
+            if project is not None and project.get('slug'):
                 CFId = await self.curseforge_api.get_id_by_slug(project['slug'])
+        
+        if self.crosswalk is not None and project is not None:
+            self.crosswalk.record(MDId, CFId, project.get('slug'))
                 
         """
         match host:
@@ -49,9 +64,15 @@ class MCM_Utils:
     
     
     async def getSpecifiedData(self, dep: tuple[str, str], dataTypes: tuple[str, str], *, prioritizeCF: bool = False) -> tuple[str | dict | list, int]:
-        async def getData(api: object, path: str | list, id: str):
-            project = await api.get_project_by_id(id, retries=20)
-            
+        values, hostid = await self.getSpecifiedDataMany(dep, [dataTypes], prioritizeCF=prioritizeCF)
+        return values[0], hostid
+    
+    
+    
+    async def getSpecifiedDataMany(self, dep: tuple[str, str], dataTypesList: list[tuple[str, str]], *, prioritizeCF: bool = False) -> tuple[list[str | dict | list], int]:
+        """Same as getSpecifiedData, but reads several fields out of a single project fetch.
+        """
+        def getValue(project: dict, path: str | list):
             if isinstance(path, list):
                 value = project
                 for key in path:
@@ -59,17 +80,21 @@ class MCM_Utils:
                 return value
             
             return project[path]
+        
+        async def getData(api: object, index: int, id: str):
+            project = await api.get_project_by_id(id)
+            return [getValue(project, dataTypes[index]) for dataTypes in dataTypesList]
                 
         data = None
         hostid = 0
         
         if prioritizeCF and dep[1] is not None:
-            data = await getData(self.curseforge_api, dataTypes[1], dep[1])
+            data = await getData(self.curseforge_api, 1, dep[1])
             hostid = 1
         elif dep[0] is not None:
-            data = await getData(self.modrinth_api, dataTypes[0], dep[0])
+            data = await getData(self.modrinth_api, 0, dep[0])
         else:
-            data = await getData(self.curseforge_api, dataTypes[1], dep[1])
+            data = await getData(self.curseforge_api, 1, dep[1])
             hostid = 1
             
         return data, hostid
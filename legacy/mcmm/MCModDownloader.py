@@ -1,62 +1,126 @@
 # MCModDownloader.py
 
-from typing import Literal
+from typing import Awaitable, Literal
 import os
 import asyncio
 import re
 import emoji
 
-from mcmm.MCSiteAPI import ModrinthAPI, CurseforgeAPI
+from mcmm.MCSiteAPI import ModrinthAPI, CurseforgeAPI, Http404Error
 from mcmm.MCM_Utils import MCM_Utils
+from mcmm.HttpClient import HttpClient
+from mcmm.Crosswalk import Crosswalk
+from mcmm.Lockfile import Lockfile, LOCKFILE_NAME
+from mcmm.helpers import hash_file, file_matches
+from mcmm.Fingerprint import fingerprint_files
 
 class MCModDownloader:
-    def __init__(self):
-        self.modrinth_api = ModrinthAPI()
-        self.curseforge_api = CurseforgeAPI()
-        self.utils = MCM_Utils()
+    def __init__(self, *, client: HttpClient = None, crosswalk: Crosswalk = None):
+        self.client = client or HttpClient.default()
+        self.modrinth_api = ModrinthAPI(client=client)
+        self.curseforge_api = CurseforgeAPI(client=client)
+        self.utils = MCM_Utils(client=client, modrinth_api=self.modrinth_api, curseforge_api=self.curseforge_api, crosswalk=crosswalk)
+        
+        self.lock_entries = [] # Every file saved (or found up to date) this run, see write_lockfile
 
 
 
-    async def download_latest(self, url: str, parameters: dict=None) -> tuple[str, bytes, dict, Literal['modrinth.com', 'www.curseforge.com']]:
+    async def download_latest(self, url: str, parameters: dict=None, output: str = './') -> tuple[str, dict, Literal['modrinth.com', 'www.curseforge.com']]:
         host = await self.utils.get_host(url)
-        filename = metadata = files = None
         
         if host is None:
             raise ValueError("Invalid URL")
+
+        match host:
+            case "modrinth.com":
+                id = self.modrinth_api.utils.get_slug_by_url(url) # Modrinth takes slugs wherever it takes ids
+            
+            case "www.curseforge.com":
+                id = await self.curseforge_api.get_id_by_url(url)
+                if id is None:
+                    raise Http404Error(f"Mod {self.curseforge_api.utils.get_slug_by_url(url)} not found")
+            
+            case _:
+                raise ValueError(f"Unsupported host: {host}")
         
-        async def getModData(API: object):
-            modData = await API.get_project(url)
-            metadata, files = await API.download(url, parameters=parameters)
+        return await self.download_project(host, id, parameters, output)
+
+
 
-            return modData, metadata, files
+    async def download_project(self, host: Literal['modrinth.com', 'www.curseforge.com'], id: str | int, parameters: dict=None, output: str = './') -> tuple[str, dict, Literal['modrinth.com', 'www.curseforge.com']]:
+        """Downloads the latest file of a project already identified by its id (or Modrinth slug).
 
+        Returns:
+            tuple[str, dict, str]: The saved file name, the version/file metadata and the host.
+        """
         match host:
             case "modrinth.com":
-                modData, metadata, files = await getModData(self.modrinth_api)
-                filename = f"{modData['title']}_{metadata['version_number']}.jar" 
+                API = self.modrinth_api
+                # Independent lookups, both batched/memoized by the API
+                modData, metadata = await asyncio.gather(API.get_project_by_id(id), API.latest_version(id, parameters))
+                if modData is None:
+                    raise Http404Error(f"Project {id} not found")
+                if metadata is not None:
+                    filename = f"{modData['title']}_{metadata['version_number']}.jar"
             
             case "www.curseforge.com":
-                modData, metadata, files = await getModData(self.curseforge_api)
-                filename = f"{modData['name']}_{metadata['id']}.jar"
+                API = self.curseforge_api
+                modData, metadata = await asyncio.gather(API.get_project_by_id(id), API.latest_file_by_id(id, parameters))
+                if metadata is not None:
+                    filename = f"{modData['name']}_{metadata['id']}.jar"
+            
+            case _:
+                raise ValueError(f"Unsupported host: {host}")
         
+        if metadata is None:
+            raise ValueError("No mod versions matching game versions or mod loader found, make sure youve gotten the right mod, and/or that it has a version for said loader/game version")
         
-        filename = re.sub(r"[ ']+", '', filename)
-        filename = re.sub(r'[;:\,=<>*%?\\|\/]+', '-', filename)
+        filename = self.clean_filename(filename)
         
-        filename = emoji.replace_emoji(filename)
+        await self.saveFile(API, metadata, filename, output)
+        self.record_lock(API, metadata, filename)
         
-        return filename, files, metadata, host
+        return filename, metadata, host
 
 
     
     async def download_mod(self, url: str, params: dict[str, str], output: str) -> tuple[bool, str, str, str|None]:
+        return await self.track_download(url, self.download_latest(url, params, output))
+
+
+
+    async def download_dependency(self, ids: tuple[str | None, int | None], params: dict[str, str], output: str, *, prioritize_cf: bool = False) -> tuple[bool, str, str, str|None]:
+        """Downloads a dependency given its (modrinth id, curseforge id), from the preferred platform first and from the other one
+        if the first has no matching file.
+        """
+        MDId, CFId = ids
+        sources = [('modrinth.com', MDId), ('www.curseforge.com', CFId)]
+        if prioritize_cf:
+            sources.reverse()
+        sources = [(host, id) for host, id in sources if id is not None]
         
+        async def download():
+            for host, id in sources[:-1]:
+                try:
+                    return await self.download_project(host, id, params, output)
+                except (Http404Error, ValueError):
+                    pass
+            
+            host, id = sources[-1]
+            return await self.download_project(host, id, params, output)
+        
+        return await self.track_download(f"dependency {MDId or CFId}", download())
+
+
+
+    async def track_download(self, label: str, download: Awaitable) -> tuple[bool, str, str, str|None]:
+        """Awaits a download (see download_project), turning its outcome into the status tuple the download modes collect.
+        """
         result = downloadedId = dependencyId = None
         failedStatus = False   
         
         try:
-            result, mod, metadata, host = await self.download_latest(url, params)
-            await self.saveFile(mod, result, output)
+            result, metadata, host = await download
                         
             downloadedId = (
                 {'data': metadata['modId'], 'host': host}
@@ -70,8 +134,8 @@ class MCModDownloader:
             print(f"sucessfully downloaded {result}")            
 
         except Exception as e:
-            print(f"Error downloading {url}: {e}")
-            result = (f"Failed to Download: {url}\nCause: {e}")
+            print(f"Error downloading {label}: {e}")
+            result = (f"Failed to Download: {label}\nCause: {e}")
             failedStatus = True
             
         return failedStatus, result, downloadedId, dependencyId
@@ -79,8 +143,6 @@ class MCModDownloader:
 
 
     async def multi_download(self, linklist: list[str], params: dict[str, str], output: str) -> tuple[list[str], list[str], list[str], list[str]]:
-        task = []
-        
         successfulList = []
         failedList = []
                 
@@ -95,14 +157,16 @@ class MCModDownloader:
                 dependencyList.append(dpid)            
             if not failedStatus:
                 downloadedList.append(dlid)
-                successfulList.append(result)
+                if result not in successfulList: # A project linked by slug and by id saves the same file
+                    successfulList.append(result)
             else:
                 failedList.append(result)
         
-        for link in linklist:
-            task.append(_simultaneousDownloads(link, params, output))   
+        # The same link listed twice would download (and report) the same file twice
+        linklist = list(dict.fromkeys(link.strip().rstrip('/') for link in linklist))
         
-        await asyncio.gather(*task)
+        # Bounded worker pool, a long list would otherwise fire every request at once
+        await self.client.scheduler.map(lambda link: _simultaneousDownloads(link, params, output), linklist)
         
         return successfulList, failedList, dependencyList, downloadedList
 
@@ -126,12 +190,233 @@ class MCModDownloader:
             
         return [], [], [], []
 
-    async def saveFile(self, file: bytes, name: str, path: str):
+    async def update_mods(self, params: dict[str, str], output: str) -> tuple[list[str], list[str], list[str], list[str]]:
+        """Updates the jars already in output/mods, only downloading the ones that have a newer version.
+        Jars are identified by their hash on Modrinth, and the ones Modrinth does not know by their fingerprint on Curseforge,
+        so checking the whole folder takes a single request per platform (plus the new files).
+        """
+        successfulList = []
+        failedList = []
+        upToDate = []
+        
+        dependencyList = []
+        downloadedList = []
+        
+        modPath = os.path.join(output, "mods")
+        jars = sorted(os.path.join(modPath, f) for f in os.listdir(modPath) if f.endswith('.jar')) if os.path.isdir(modPath) else []
+        
+        if len(jars) == 0:
+            print(f"No mods found in {modPath}")
+            return successfulList, failedList, dependencyList, downloadedList
+        
+        async def replaceJar(API: object, metadata: dict, filename: str, jar: str):
+            filename = self.clean_filename(filename)
+            await self.saveFile(API, metadata, filename, output)
+            self.record_lock(API, metadata, filename)
+            
+            if os.path.basename(jar) != filename:
+                os.remove(jar)
+                
+            successfulList.append(f"{os.path.basename(jar)} -> {filename}")
+            print(f"sucessfully updated {filename}")
+        
+        # Modrinth, by sha1
+        hashes = await self.client.scheduler.map(lambda jar: asyncio.to_thread(hash_file, jar, 'sha1'), jars)
+        jarsByHash = dict(zip(hashes, jars))
+        
+        modrinthCause = "Not found on Modrinth" # Why the jars left to Curseforge could not be updated there
         try:
-            modPath = os.path.join(path, "mods")
-            os.makedirs(modPath, exist_ok=True)
-            finalPath = os.path.join(modPath, name)
-            with open(finalPath, "wb") as f:
-                f.write(file)
+            versions = await self.modrinth_api.latest_versions_from_hashes(
+                list(jarsByHash), 'sha1',
+                loaders=params.get('loader'),
+                game_versions=[x for x in params.get('game_versions') or [] if x]
+            )
         except Exception as e:
-            print(f"Error saving file: {e}")
\ No newline at end of file
+            # Every jar is left to Curseforge
+            print(f"Error checking the jars on Modrinth: {e}")
+            versions = {}
+            modrinthCause = f"Modrinth lookup failed ({e})"
+        
+        async def updateModrinthJar(hash: str):
+            jar = jarsByHash[hash]
+            version = versions[hash]
+            
+            downloadedList.append({'data': version['project_id'], 'host': 'modrinth.com'})
+            if len(version['dependencies']) > 0:
+                dependencyList.append({'data': version['dependencies'], 'host': 'modrinth.com'})
+            
+            if any(file['hashes'].get('sha1') == hash for file in version['files']):
+                upToDate.append(jar)
+                file = next(file for file in version['files'] if file['hashes'].get('sha1') == hash)
+                self.record_lock(self.modrinth_api, version, os.path.basename(jar), info={'url': file['url'], 'size': file.get('size'), 'hashes': file['hashes']})
+                return
+            
+            try:
+                project = await self.modrinth_api.get_project_by_id(version['project_id'])
+                await replaceJar(self.modrinth_api, version, f"{project['title']}_{version['version_number']}.jar", jar)
+            except Exception as e:
+                print(f"Error updating {os.path.basename(jar)}: {e}")
+                failedList.append(f"Failed to Update: {os.path.basename(jar)}\nCause: {e}")
+        
+        await self.client.scheduler.map(updateModrinthJar, [hash for hash in jarsByHash if hash in versions])
+        
+        # Curseforge, by fingerprint
+        unknownJars = [jar for hash, jar in jarsByHash.items() if hash not in versions]
+        fingerprints = await fingerprint_files(unknownJars)
+        jarsByFingerprint = dict(zip(fingerprints, unknownJars))
+        
+        curseforgeCause = "not found on Curseforge"
+        try:
+            matches = await self.curseforge_api.get_fingerprint_matches(list(jarsByFingerprint))
+        except Exception as e:
+            # The Modrinth updates above are kept, the jars left are reported as failed
+            print(f"Error checking the jars on Curseforge: {e}")
+            matches = {}
+            curseforgeCause = f"Curseforge lookup failed ({e})"
+        
+        async def updateCurseforgeJar(fingerprint: int):
+            jar = jarsByFingerprint[fingerprint]
+            match = matches[fingerprint]
+            current = match['file']
+            
+            downloadedList.append({'data': match['id'], 'host': 'www.curseforge.com'})
+            
+            try:
+                latest = await self.curseforge_api.latest_file_by_id(match['id'], params) or current
+                
+                if latest['id'] == current['id'] or latest['fileDate'] <= current['fileDate']:
+                    latest = current
+                    upToDate.append(jar)
+                    self.record_lock(self.curseforge_api, current, os.path.basename(jar))
+                else:
+                    project = await self.curseforge_api.get_project_by_id(match['id'])
+                    await replaceJar(self.curseforge_api, latest, f"{project['name']}_{latest['id']}.jar", jar)
+                    
+                if len(latest['dependencies']) > 0:
+                    dependencyList.append({'data': latest['dependencies'], 'host': 'www.curseforge.com'})
+            except Exception as e:
+                print(f"Error updating {os.path.basename(jar)}: {e}")
+                failedList.append(f"Failed to Update: {os.path.basename(jar)}\nCause: {e}")
+        
+        await self.client.scheduler.map(updateCurseforgeJar, list(matches))
+        
+        notFound = [jar for fingerprint, jar in jarsByFingerprint.items() if fingerprint not in matches]
+        for jar in notFound:
+            failedList.append(f"Failed to Update: {os.path.basename(jar)}\nCause: {modrinthCause}, {curseforgeCause}")
+        
+        print(f"{len(successfulList)} mods updated, {len(upToDate)} already up to date, {len(notFound)} not found")
+        return successfulList, failedList, dependencyList, downloadedList
+
+
+
+    async def install_locked(self, lockPath: str, output: str) -> tuple[list[str], list[str], list[str], list[str]]:
+        """Downloads the files recorded in a lockfile straight from their urls, without a single api call.
+        Files already in output/mods whose hashes match the lockfile are skipped.
+        """
+        successfulList = []
+        failedList = []
+        
+        dependencyList = []
+        downloadedList = []
+        
+        try:
+            lockfile = Lockfile.load(lockPath)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {lockPath}: {e}")
+            return successfulList, failedList, dependencyList, downloadedList
+        
+        entries = list(lockfile.entries.values())
+        
+        if len(entries) == 0:
+            print(f"No locked mods found in {lockPath}")
+            return successfulList, failedList, dependencyList, downloadedList
+        
+        modPath = os.path.join(output, "mods")
+        utils = self.modrinth_api.utils # Any api utils will do, the urls are already known
+        upToDate = []
+        
+        async def install(entry: dict):
+            filename = os.path.basename(entry['filename'])
+            path = os.path.join(modPath, filename)
+            downloadedList.append({'data': entry['project_id'], 'host': entry['platform']})
+            
+            if await asyncio.to_thread(Lockfile.matches, entry, path):
+                upToDate.append(filename)
+                self.client.metrics.count('downloads_skipped')
+                return
+            
+            try:
+                await utils.Dl_File(entry['url'], path, size=entry.get('size'), hashes=entry.get('hashes'))
+                
+                successfulList.append(filename)
+                print(f"sucessfully downloaded {filename}")
+            except Exception as e:
+                print(f"Error downloading {filename}: {e}")
+                failedList.append(f"Failed to Download: {entry['url']}\nCause: {e}")
+        
+        await self.client.scheduler.map(install, entries)
+        
+        print(f"{len(successfulList)} mods downloaded, {len(upToDate)} already matching the lockfile")
+        return successfulList, failedList, dependencyList, downloadedList
+
+
+
+    def record_lock(self, API: object, metadata: dict, filename: str, *, info: dict = None):
+        """Remembers a saved file for the lockfile, info defaults to API.file_info of the metadata."""
+        info = info or API.file_info(metadata)
+        curseforge = API is self.curseforge_api
+        
+        self.lock_entries.append({
+            'platform': 'www.curseforge.com' if curseforge else 'modrinth.com',
+            'project_id': metadata['modId'] if curseforge else metadata['project_id'],
+            'file_id': metadata['id'],
+            'filename': filename,
+            'url': info['url'],
+            'size': info['size'],
+            'hashes': info['hashes']
+        })
+
+
+
+    def write_lockfile(self, output: str) -> str:
+        """Merges the files saved this run into output/mcmm.lock, returns its path."""
+        lockPath = os.path.join(output, LOCKFILE_NAME)
+        lockfile = Lockfile.load(lockPath)
+        
+        for entry in self.lock_entries:
+            lockfile.add(entry)
+        
+        lockfile.save(os.path.join(output, "mods"))
+        return lockPath
+
+
+
+    def clean_filename(self, filename: str) -> str:
+        filename = re.sub(r"[ ']+", '', filename)
+        filename = re.sub(r'[;:\,=<>*%?\\|\/]+', '-', filename)
+        
+        return emoji.replace_emoji(filename)
+
+
+
+    async def saveFile(self, API: object, metadata: dict, name: str, path: str) -> int:
+        """Streams the file described by metadata into the mods folder of path.
+
+        Args:
+            API (object): The ModrinthAPI or CurseforgeAPI the metadata came from.
+            metadata (dict): The version (Modrinth) or file (Curseforge) to download.
+            name (str): Final file name.
+            path (str): Output directory, the file is saved under path/mods.
+
+        Returns:
+            int: The amount of bytes written, 0 if the file was already there (same size and hash).
+        """
+        modPath = os.path.join(path, "mods")
+        finalPath = os.path.join(modPath, name)
+        
+        info = API.file_info(metadata)
+        if await asyncio.to_thread(file_matches, finalPath, info['size'], info['hashes']):
+            self.client.metrics.count('downloads_skipped')
+            return 0
+        
+        return await API.download_file(metadata, finalPath)
@@ -1,11 +1,21 @@
 # MCSiteAPI.py
 
-import aiohttp
 import os
 import asyncio
 import configparser
+import json
+import hashlib
+import time
+import aiohttp
 
+from contextlib import aclosing
 from typing import Callable
+from urllib.parse import quote
+
+from mcmm.HttpClient import HttpClient, endpoint_class
+from mcmm.Batcher import Batcher
+from mcmm.Memo import Memo
+from mcmm.helpers import async_writer, iter_json_array, pick_hash, file_matches
 
 class Http404Error(Exception):
     pass
@@ -16,75 +26,242 @@ class HttpError(Exception):
 class InvalidKeyError(Exception):
     pass
 
+class HashMismatchError(aiohttp.ClientPayloadError): # A corrupt payload, retried like any other
+    pass
+
+class RangeNotSupportedError(Exception):
+    pass
+
 class ModrinthAPI:
-    def __init__(self, api_url="https://api.modrinth.com"):
+    def __init__(self, api_url="https://api.modrinth.com", *, client: HttpClient = None):
         self.api_url = api_url
-        self.utils = utils()
+        self.utils = utils(client)
+        
+        # Single id lookups made at the same time are merged into one bulk request
+        self.project_batcher = Batcher(self.get_projects)
+        self.version_batcher = Batcher(self.get_versions)
+        
+        # Per run memo of resolved projects and latest versions
+        self.memo = Memo()
   
 
     async def get_project(self, url: str):
-        response = await self.utils.get(f"{self.api_url}/v2/project/{self.utils.get_slug_by_url(url)}")
+        slug = self.utils.get_slug_by_url(url)
+        response = await self.get_project_by_id(slug)
+        
+        if response is None:
+            raise Http404Error(f"Project {slug} not found")
         return response
 
 
 
-    async def get_project_by_id(self, id: str, *, retries: int = 7):
-        try:
-            response = await self.utils.get(f"{self.api_url}/v2/project/{id}", retries=retries)
-            return response
-        except Http404Error:
-            return None
+    async def get_project_by_id(self, id: str):
+        return await self.memo.get(('project', id), lambda: self.project_batcher.get(id))
     
 
 
     async def get_version(self, version_id: str):
-        response = await self.utils.get(f"{self.api_url}/v2/version/{version_id}")
+        response = await self.version_batcher.get(version_id)
+        
+        if response is None:
+            raise Http404Error(f"Version {version_id} not found")
         return response
     
+    
+    
+    async def get_projects(self, ids: list[str]) -> dict[str, dict]:
+        """Fetches many projects at once through the bulk endpoint.
 
+        Args:
+            ids (list[str]): Project ids and/or slugs.
 
-    async def project_files(self, project_slug: str, parameters: dict = None):
+        Returns:
+            dict[str, dict]: The projects found, keyed by the requested id/slug. Projects that do not exist are left out.
+        """
+        return await self._bulk_get('project', 'projects', ids)
+    
+    
+    
+    async def get_versions(self, ids: list[str]) -> dict[str, dict]:
+        """Same as get_projects, but for version ids.
+        """
+        return await self._bulk_get('version', 'versions', ids)
+    
+    
+    
+    async def latest_versions_from_hashes(self, hashes: list[str], algorithm: str = 'sha1', *, loaders: list[str] = None, game_versions: list[str] = None, chunk_size: int = 1000) -> dict[str, dict]:
+        """Finds the newest version (matching the loaders/game versions) of the projects the given file hashes belong to.
+
+        Args:
+            hashes (list[str]): Hex digests of local files.
+            algorithm (str, optional): 'sha1' or 'sha512'. Defaults to 'sha1'.
+
+        Returns:
+            dict[str, dict]: Newest version, keyed by the hash of the local file. Unknown hashes are left out.
+        """
+        payload = {'algorithm': algorithm}
+        if loaders:
+            payload['loaders'] = loaders
+        if game_versions:
+            payload['game_versions'] = game_versions
+            
+        async def fetch(chunk: list[str]):
+            return await self.utils.post(f"{self.api_url}/v2/version_files/update", {**payload, 'hashes': chunk})
+        
+        chunks = [hashes[i:i + chunk_size] for i in range(0, len(hashes), chunk_size)]
+        responses = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+        
+        result = {}
+        for response in responses:
+            result.update(response)
+        return result
+    
+    
+    
+    async def _bulk_get(self, single: str, bulk: str, ids: list[str]) -> dict[str, dict]:
+        found = {}
+        missing = []
+        
+        # Items are cached one by one, under the url of their single lookup, so any later batch can reuse them
+        for id in dict.fromkeys(ids):
+            try:
+                cached = self.utils.cache_lookup(f"{self.api_url}/v2/{single}/{id}")
+            except Http404Error:
+                continue
+            
+            if cached is not None:
+                found[id] = cached
+            else:
+                missing.append(id)
+        
+        async def fetch(chunk: list[str]):
+            return await self.utils.get(f"{self.api_url}/v2/{bulk}", params={'ids': json.dumps(chunk)}, cache=False)
+        
+        responses = await asyncio.gather(*(fetch(chunk) for chunk in self.utils.chunk_ids(missing)))
+        
+        byKey = {}
+        for response in responses:
+            for item in response:
+                keys = [item['id']] + ([item['slug']] if item.get('slug') else [])
+                for key in keys:
+                    byKey[key.lower()] = item
+                    self.utils.cache_store(f"{self.api_url}/v2/{single}/{key}", item)
+        
+        for id in missing:
+            item = byKey.get(str(id).lower())
+            if item is not None:
+                found[id] = item
+            else:
+                self.utils.cache_missing(f"{self.api_url}/v2/{single}/{id}")
+                
+        return found
+    
+
+
+    async def project_files(self, project_slug: str, parameters: dict = None, *, lean: bool = False):
+        """Every version of the project matching parameters, newest first.
+        With lean, the list is decoded as it streams in and only the fields mcmm uses are kept (see lean_version).
+        """
+        if lean:
+            async def decode(response):
+                return [self.lean_version(version) async for version in iter_json_array(response.content.iter_chunked(65536))]
+            
+            fetchResult = await self.utils.get(self.versions_query(project_slug, parameters), decode=decode, variant='lean')
+        else:
+            fetchResult = await self.utils.get(self.versions_query(project_slug, parameters))
+            
+        response = sorted(fetchResult, key=lambda x: x['date_published'], reverse=True)
+        return response
+    
+    
+    
+    async def latest_version(self, project_slug: str, parameters: dict = None) -> dict | None:
+        """The newest version of the project matching parameters (lean, see lean_version), None if there is none.
+        Popular projects have thousands of versions, so the list is streamed and the newest one picked in a single pass.
+        """
+        async def newest(response):
+            best = None
+            async for version in iter_json_array(response.content.iter_chunked(65536)):
+                if best is None or version['date_published'] > best['date_published']:
+                    best = self.lean_version(version)
+            return best
+        
+        query = self.versions_query(project_slug, parameters)
+        return await self.memo.get(('latest', query), lambda: self.utils.get(query, decode=newest, variant='latest'))
+    
+    
+    
+    def versions_query(self, project_slug: str, parameters: dict = None) -> str:
         query = f"{self.api_url}/v2/project/{project_slug}/version"
         
         if parameters:     
             queryParams = []
 
-            version = parameters.get('game_versions')
+            version = [x for x in parameters.get('game_versions') or [] if x]
             if version:
-                queryParams.append(f"game_versions=[{await self.utils.format_query(version)}]")
+                queryParams.append(f"game_versions=[{self.utils.format_query(version)}]")
 
             loader = parameters.get('loader')
             if loader:
-                queryParams.append(f"loaders=[{await self.utils.format_query(loader)}]")
+                queryParams.append(f"loaders=[{self.utils.format_query(loader)}]")
             
             type = parameters.get('version_type')
             if type:
-                queryParams.append(f"version_type=[{await self.utils.format_query(type)}]")
+                queryParams.append(f"version_type=[{self.utils.format_query(type)}]")
 
-            query += '?' + '&'.join(queryParams)
+            if queryParams:
+                query += '?' + '&'.join(queryParams)
             
-        fetchResult = await self.utils.get(query)
-        response = sorted(fetchResult, key=lambda x: x['date_published'], reverse=True)
-        return response
+        return query
+    
+    
+    
+    LEAN_FILE_FIELDS = ('url', 'filename', 'hashes', 'primary', 'size')
+    
+    def lean_version(self, version: dict) -> dict:
+        """Only keeps what mcmm uses out of a version (changelogs alone can be most of a version list)."""
+        return {
+            'id': version['id'],
+            'project_id': version['project_id'],
+            'version_number': version['version_number'],
+            'date_published': version['date_published'],
+            'files': [{key: file.get(key) for key in self.LEAN_FILE_FIELDS} for file in version['files']],
+            'dependencies': version['dependencies']
+        }
     
 
 
-    async def download(self, url: str, *,  parameters: dict = None):
-        version = None
+    async def latest_file(self, url: str, *, parameters: dict = None) -> dict:
         if not url:
             raise ValueError("You must provide a valid url")
 
         project_slug = self.utils.get_slug_by_url(url)
-        versionList = await self.project_files(project_slug, parameters)
+        version = await self.latest_version(project_slug, parameters)
 
-        if len(versionList) == 0:
+        if version is None:
             raise ValueError("No mod versions matching game versions or mod loader found, make sure youve gotten the right mod, and/or that it has a version for said loader/game version")
 
-        version = versionList[0]
+        return version
+
+
 
-        fileUrl = version['files'][0]['url']
-        response = await self.utils.Dl_Data(fileUrl)
-        return version, response
+    def file_info(self, version: dict) -> dict:
+        """Url, file name, size and hashes of the file of the version that gets downloaded (the primary one)."""
+        file = next((file for file in version['files'] if file.get('primary')), version['files'][0])
+        return {'url': file['url'], 'filename': file.get('filename'), 'size': file.get('size'), 'hashes': file.get('hashes') or {}}
+
+
+
+    async def download_file(self, version: dict, path: str) -> int:
+        info = self.file_info(version)
+        return await self.utils.Dl_File(info['url'], path, size=info['size'], hashes=info['hashes'])
+
+
+
+    async def download(self, url: str, path: str, *,  parameters: dict = None) -> dict:
+        version = await self.latest_file(url, parameters=parameters)
+        await self.download_file(version, path)
+        return version
 
     
 
@@ -92,42 +269,150 @@ class ModrinthAPI:
 
 
 class CurseforgeAPI:
-    def __init__(self, api_url="https://api.curseforge.com"):
+    def __init__(self, api_url="https://api.curseforge.com", *, client: HttpClient = None, api_key: str = None):
+        self.api_url = api_url
+        self._api_key = api_key
+        self.utils = utils(client)
         
-        config = configparser.ConfigParser()
-        filePath = os.path.dirname(__file__)
-        configPath = os.path.join(filePath, "config", 'config.ini')
-        config.read(configPath)
+        # Single id lookups made at the same time are merged into one bulk request
+        self.project_batcher = Batcher(self.get_projects)
+        self.file_batcher = Batcher(self.get_files)
         
-        self.api_url = api_url
-        self.api_key = config['Curseforge'].get('api_key')
-        self.utils = utils()
+        # Per run memo of slug -> id, resolved mods and latest files
+        self.memo = Memo()
         
-        self.api_headers = {
+        
+        
+    @property
+    def api_key(self) -> str:
+        # Read from config.ini on first use, not every time an API object is built
+        if self._api_key is None:
+            config = configparser.ConfigParser()
+            filePath = os.path.dirname(__file__)
+            configPath = os.path.join(filePath, "config", 'config.ini')
+            config.read(configPath)
+            
+            self._api_key = config['Curseforge'].get('api_key')
+        return self._api_key
+    
+    
+    @property
+    def api_headers(self) -> dict:
+        return {
         'Accept': 'application/json',
         'x-api-key': self.api_key
         }
-        
-        
-        
+    
+    
+    
     async def is_key_valid(self):
+        """Whether Curseforge accepts the api key. A successful check goes through the response cache (a day, see ResponseCache.TTLS),
+        under a hash of the key, so most runs skip the round trip and a new key is always checked. Failed checks are never cached.
+        """
+        keyHash = hashlib.sha256((self.api_key or '').encode()).hexdigest()[:16]
         try:
-            await self.utils.get(f"{self.api_url}/v1/games", headers=self.api_headers, retries=2)
+            await self.utils.get(f"{self.api_url}/v1/games", headers=self.api_headers, retries=2, variant=f'key-{keyHash}', remember_missing=False)
             return True
-        except InvalidKeyError:
+        except (InvalidKeyError, Http404Error):
             return False
 
 
 
     async def get_project(self, url: str):
         mod_id = await self.get_id_by_url(url)
+        
+        if mod_id is None:
+            raise Http404Error(f"Mod {self.utils.get_slug_by_url(url)} not found")
         return await self.get_project_by_id(mod_id)
     
 
 
-    async def get_project_by_id(self, id: int, *, retries: int=7):
-        response = await self.utils.get(f"{self.api_url}/v1/mods/{id}", headers=self.api_headers, retries=retries)
-        return response['data']
+    async def get_project_by_id(self, id: int):
+        response = await self.memo.get(('project', int(id)), lambda: self.project_batcher.get(int(id)))
+        
+        if response is None:
+            raise Http404Error(f"Mod {id} not found")
+        return response
+
+
+
+    async def get_file(self, file_id: int):
+        response = await self.file_batcher.get(int(file_id))
+        
+        if response is None:
+            raise Http404Error(f"File {file_id} not found")
+        return response
+
+
+
+    async def get_projects(self, ids: list[int]) -> dict[int, dict]:
+        """Fetches many mods at once through the bulk endpoint.
+
+        Args:
+            ids (list[int]): Mod ids.
+
+        Returns:
+            dict[int, dict]: The mods found, keyed by id. Mods that do not exist are left out.
+        """
+        return await self._bulk_post('mods', 'modIds', ids, lambda mod: f"{self.api_url}/v1/mods/{mod['id']}", lookup_url=lambda id: f"{self.api_url}/v1/mods/{id}")
+
+
+
+    async def get_files(self, ids: list[int]) -> dict[int, dict]:
+        """Same as get_projects, but for file ids.
+        """
+        return await self._bulk_post('mods/files', 'fileIds', ids, lambda file: f"{self.api_url}/v1/mods/{file['modId']}/files/{file['id']}")
+
+
+
+    async def _bulk_post(self, endpoint: str, field: str, ids: list[int], single_url: Callable[[dict], str], *, lookup_url: Callable[[int], str] = None, chunk_size: int = 500) -> dict[int, dict]:
+        found = {}
+        missing = []
+        
+        # The bulk endpoints are POSTs, so items are cached one by one under the url of their single lookup instead
+        # (file urls need the mod id, which is unknown before the lookup, so files are only read back from cache by their own lookups)
+        for id in dict.fromkeys(ids):
+            try:
+                cached = self.utils.cache_lookup(lookup_url(id)) if lookup_url else None
+            except Http404Error:
+                continue
+            
+            if cached is not None:
+                found[id] = cached['data']
+            else:
+                missing.append(id)
+        
+        async def fetch(chunk: list[int]):
+            return await self.utils.post(f"{self.api_url}/v1/{endpoint}", {field: chunk}, headers=self.api_headers)
+        
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        responses = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+        
+        for response in responses:
+            for item in response['data']:
+                found[item['id']] = item
+                self.utils.cache_store(single_url(item), {'data': item})
+        
+        if lookup_url:
+            for id in missing:
+                if id not in found:
+                    self.utils.cache_missing(lookup_url(id))
+                
+        return found
+
+
+
+    async def get_fingerprint_matches(self, fingerprints: list[int]) -> dict[int, dict]:
+        """Identifies files by their Curseforge fingerprint (see Fingerprint.curseforge_fingerprint), in a single request.
+
+        Returns:
+            dict[int, dict]: The exact matches keyed by fingerprint, each holding the mod id ('id'), the matched 'file' and the mod 'latestFiles'.
+        """
+        if len(fingerprints) == 0:
+            return {}
+        
+        response = await self.utils.post(f"{self.api_url}/v1/fingerprints/432", {'fingerprints': fingerprints}, headers=self.api_headers)
+        return {match['file']['fileFingerprint']: match for match in response['data']['exactMatches']}
 
 
 
@@ -138,17 +423,20 @@ class CurseforgeAPI:
 
 
     async def get_id_by_slug(self, slug: str):
-        data = await self.utils.get(f'{self.api_url}/v1/mods/search', headers=self.api_headers, params={
-            'slug': slug,
-            'classId': '6',
-            'gameId': '432'
-        })
-
-        if len(data['data']) > 0:
-            result = data['data'][0]['id']
-            return result
-        else:
-            return None
+        async def search():
+            data = await self.utils.get(f'{self.api_url}/v1/mods/search', headers=self.api_headers, params={
+                'slug': slug,
+                'classId': '6',
+                'gameId': '432'
+            })
+
+            if len(data['data']) > 0:
+                result = data['data'][0]['id']
+                return result
+            else:
+                return None
+            
+        return await self.memo.get(('id', slug), search)
 
 
     async def get_slug_by_url(self, url: str):
@@ -169,66 +457,127 @@ class CurseforgeAPI:
 
 
     async def project_files(self, url: str, parameters: dict=None):
-        finalParamList = []
         id = await self.get_id_by_url(url)
-        finalFiles = []
-
-        if parameters:
-            params = {}   
-
-            version = parameters.get('game_versions')
-            if version:
-                params['gameVersion'] = version
-            
-            loaders = [self.LOADER_MAPPINGS.get(x , 0) for x in parameters.get('loader', [])]
-            loaders = set(loaders)
-
-            if len(loaders) > 1:
-                for ml in loaders:
-                    x = params.copy()
-                    x.update({
-                        'modLoaderType': ml
-                    })
-
-                    finalParamList.append(x)
-
-            else:
-                finalParamList = [params.copy()]
-                finalParamList[0]['modLoaderType'] = loaders.pop()
-                    
-            for parameter in finalParamList:
-                files = await self.utils.get(f'{self.api_url}/v1/mods/{id}/files', headers=self.api_headers, params=parameter)
-                finalFiles += files['data']
-            
-        else:        
-            files = await self.utils.get(f'{self.api_url}/v1/mods/{id}/files', headers=self.api_headers)
-            finalFiles += files['data']
+        return await self.project_files_by_id(id, parameters)
+    
+    
+    
+    async def project_files_by_id(self, id: int, parameters: dict=None):
+        """Every file of the mod matching parameters, newest first. Each loader is queried concurrently, through every page.
+        """
+        async def allFiles(query: dict):
+            files = []
+            async for page in self.iter_project_files(id, query):
+                files += page
+            return files
+        
+        results = await asyncio.gather(*(allFiles(query) for query in self.file_queries(parameters)))
+        finalFiles = [file for files in results for file in files]
             
         result = sorted(finalFiles, key=lambda x: x['fileDate'], reverse=True)
         
         return result
     
+    
+    
+    async def latest_file_by_id(self, id: int, parameters: dict=None, *, page_size: int = 10) -> dict | None:
+        """The newest file of the mod matching parameters, None if there is none.
+
+        The files endpoint lists newest files first, so only the first (small) page of each loader query is fetched,
+        all loaders at the same time, and pagination stops there.
+        """
+        async def newest(query: dict):
+            async with aclosing(self.iter_project_files(id, query, page_size=page_size)) as pages:
+                async for page in pages:
+                    return max(page, key=lambda x: x['fileDate'], default=None)
+        
+        async def resolve():
+            candidates = await asyncio.gather(*(newest(query) for query in queries))
+            return max((file for file in candidates if file), key=lambda x: x['fileDate'], default=None)
+        
+        queries = self.file_queries(parameters)
+        return await self.memo.get(('latest', int(id), json.dumps(queries, sort_keys=True)), resolve)
+    
+    
+    
+    async def iter_project_files(self, id: int, query: dict, *, page_size: int = 50):
+        """Yields the files of the mod page by page, a page is only requested once the previous one was consumed.
+        """
+        index = 0
+        while True:
+            response = await self.utils.get(f'{self.api_url}/v1/mods/{id}/files', headers=self.api_headers, params={**query, 'index': index, 'pageSize': page_size})
+            files = response['data']
+            
+            if len(files) == 0:
+                return
+            yield files
+            
+            index += len(files)
+            if index >= response.get('pagination', {}).get('totalCount', 0):
+                return
+    
+    
+    
+    def file_queries(self, parameters: dict = None) -> list[dict]:
+        """Query parameters for the files endpoint, one set per mod loader (the endpoint only filters by one loader at a time).
+        """
+        params = {}
+        if not parameters:
+            return [params]
+        
+        version = [x for x in parameters.get('game_versions') or [] if x]
+        if version:
+            params['gameVersion'] = version[0]
+        
+        loaders = {self.LOADER_MAPPINGS.get(x , 0) for x in parameters.get('loader') or []}
+        if len(loaders) == 0:
+            return [params]
+        
+        return [{**params, 'modLoaderType': ml} for ml in loaders]
 
 
-    async def download(self, url: str,  *, parameters: dict = None):
+
+    async def latest_file(self, url: str, *, parameters: dict = None) -> dict:
         if not url:
             raise ValueError("You must provide a valid url")
         
-        fileList = await self.project_files(url, parameters)
+        id = await self.get_id_by_url(url)
+        file = await self.latest_file_by_id(id, parameters)
         
-        if len(fileList) == 0:
+        if file is None:
             raise ValueError("No mod versions matching game versions or mod loader found, make sure youve gotten the right mod, and/or that it has a version for said loader/game version")
         
-        file = fileList[0]
-        
-        fileUrl = file['downloadUrl']
-        response = await self.utils.Dl_Data(fileUrl)
-        return file, response
+        return file
+    
+    
+    
+    HASH_ALGORITHMS = {
+        1: 'sha1',
+        2: 'md5'
+    }
+    
+    def file_info(self, file: dict) -> dict:
+        """Same as ModrinthAPI.file_info, hashes are keyed by the algorithm name instead of Curseforge's algo number."""
+        hashes = {self.HASH_ALGORITHMS[hash['algo']]: hash['value'] for hash in file.get('hashes') or [] if hash.get('algo') in self.HASH_ALGORITHMS}
+        return {'url': file['downloadUrl'], 'filename': file.get('fileName'), 'size': file.get('fileLength'), 'hashes': hashes}
+    
+    
+    
+    async def download_file(self, file: dict, path: str) -> int:
+        info = self.file_info(file)
+        return await self.utils.Dl_File(info['url'], path, size=info['size'], hashes=info['hashes'])
+    
+    
+    
+    async def download(self, url: str, path: str, *, parameters: dict = None) -> dict:
+        file = await self.latest_file(url, parameters=parameters)
+        await self.download_file(file, path)
+        return file
     
 
 class utils:
-    def __init__(self):
-        self.globalRateLimitMessageReset = 0
+    def __init__(self, client: HttpClient = None):
+        self.client = client or HttpClient.default()
 
 
     def get_slug_by_url(self, url: str):
@@ -240,57 +589,481 @@ class utils:
             raise ValueError("Invalid URL")
 
 
-    async def _httpSafeGuards(self, url: str, act: Callable, *, headers: dict = None, params: dict = None, retries: int = 7):
+    async def _httpSafeGuards(self, url: str, act: Callable, *, method: str = 'GET', headers: dict | Callable[[], dict] = None, params: dict = None, json: any = None, retries: int = 7, kind: str = 'metadata', cache_state: str = None):
+        """Makes the request, through the rate limiter and the scheduler, retrying transient failures. Responses that went through are handed to act.
+        headers can also be a function, called before every attempt (so a retried download can ask for the bytes it is still missing).
+        Every call is recorded in the client metrics (see Metrics.RequestTrace), cache_state being how the response cache was involved.
+        """
+        trace = self.client.metrics.trace(method, url, endpoint_class(url), kind=kind, cache=cache_state)
+        try:
+            return await self._attempts(url, act, trace, method=method, headers=headers, params=params, json=json, retries=retries, kind=kind)
+        except BaseException as e:
+            if not isinstance(trace.status, int) or trace.status < 400:
+                trace.status = type(e).__name__
+            raise
+        finally:
+            trace.finish()
+
+
+    async def _attempts(self, url: str, act: Callable, trace: object, *, method: str, headers: dict | Callable[[], dict], params: dict, json: any, retries: int, kind: str):
         attempt = 0
-        async with aiohttp.ClientSession() as session:
-            while attempt < retries:        
-                async with session.get(url, headers=headers, params=params) as response:
-                    if response.status == 200:
-                        return await act(response)
-                        
-                    elif response.status == 429:
-                        retry_after = response.headers.get('X-Ratelimit-Reset')
-                        await self.handle_rate_limit_reset(retry_after)
-                        
-                    elif response.status == 403:
-                        raise InvalidKeyError(f"Invalid api key")
+        bucket = self.client.rate_limiter.bucket(url)
+        policy = self.client.retry_policy
+        
+        while True:
+            # Waiting on the rate limit happens before taking a slot, so it does not block other hosts
+            mark = time.monotonic()
+            await bucket.acquire()
+            trace.rate_limit_wait += time.monotonic() - mark
+            
+            answered = False
+            try:
+                mark = time.monotonic()
+                async with self.client.scheduler.slot(kind, url):
+                    trace.queue_wait += time.monotonic() - mark
                     
-                    elif response.status != 404:
-                        raise HttpError(f"Http get error {response.status}: {response.reason}")
+                    if bucket.blocked: # The budget ran out while this request was queued for a slot
+                        continue
                     
-                    else:
-                        attempt += 1
-                await asyncio.sleep(0.5)                   
-        raise Http404Error()
+                    trace.attempts += 1
+                    async with self.client.request(method, url, headers=headers() if callable(headers) else headers, params=params, json=json) as response:
+                        answered = True
+                        trace.status = response.status
+                        bucket.update(response.headers)
+                        
+                        if response.status in (200, 206, 304):
+                            try:
+                                return await act(response)
+                            finally:
+                                trace.bytes += response.content.total_bytes
+                            
+                        elif response.status == 429:
+                            bucket.limited(response.headers)
+                            continue
+                            
+                        elif response.status == 403:
+                            raise InvalidKeyError(f"Invalid api key")
+                        
+                        elif response.status == 404:
+                            raise Http404Error(f"Not found: {url}")
+                        
+                        elif policy.is_transient(response.status):
+                            error = HttpError(f"Http get error {response.status}: {response.reason}")
+                        
+                        else:
+                            raise HttpError(f"Http get error {response.status}: {response.reason}")
+                        
+            except policy.TRANSIENT_ERRORS as e:
+                if not answered:
+                    bucket.unanswered()
+                error = e
+            
+            attempt += 1
+            if attempt >= retries:
+                raise error
+            await asyncio.sleep(policy.delay(attempt))
+
+
+    async def get(self, url: str, *, headers: dict = None, params: dict = None, retries: int = 7, cache: bool = True, decode: Callable = None, variant: str = None, remember_missing: bool = True) -> dict:
+        """GET an api endpoint, through the response cache.
+
+        Args:
+            decode (Callable, optional): Turns the response into the returned (and cached) data. Defaults to decoding the whole json/text body.
+            variant (str, optional): Name of the decode function, cached results of different decodes of the same url are kept apart.
+            remember_missing (bool, optional): Whether a 404 is cached as a negative entry. Defaults to True.
+        """
+        responseCache = self.client.cache if cache else None
+        decode = decode or self._decode
+        key = entry = None
+        
+        if responseCache is not None and responseCache.cacheable(url):
+            key = responseCache.key(url, {**(params or {}), '__variant': variant} if variant else params)
+            entry = responseCache.get(key)
+            if entry is not None and entry.missing and not remember_missing:
+                entry = None
+            
+            if entry is not None and entry.fresh:
+                self.client.metrics.cache_hit(url, endpoint_class(url))
+                if entry.missing:
+                    raise Http404Error(f"Not found (cached): {url}")
+                return entry.data
+            
+            if entry is not None and not entry.missing:
+                headers = {**(headers or {}), **entry.validators()}
+            else:
+                entry = None
+        
+        async def adquire(response: object):
+            if response.status == 304:
+                responseCache.revalidated(key)
+                return entry.data
+            
+            data = await decode(response)
+                
+            if key is not None:
+                responseCache.put(key, url, data, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+            return data
+            
+        async def fetch():
+            try:
+                return await self._httpSafeGuards(url, act = adquire, headers=headers,  params=params, retries=retries, cache_state='miss' if key is not None else None)
+            except Http404Error:
+                if key is not None and remember_missing:
+                    responseCache.put_missing(key, url)
+                raise
+        
+        flightKey = (url, json.dumps(params, sort_keys=True, default=str), variant, cache)
+        return await self.client.inflight.do(flightKey, fetch)
+
 
+    async def post(self, url: str, payload: dict, *, headers: dict = None, retries: int = 7) -> dict:
+        return await self._httpSafeGuards(url, act = self._decode, method='POST', headers=headers, json=payload, retries=retries)
 
-    async def handle_rate_limit_reset(self, retry_after: int) -> bool:
-        if self.globalRateLimitMessageReset <= 0:    
-            print(f'Too many requests, please wait...')
-            self.globalRateLimitMessageReset += 60
+
+    async def _decode(self, response: object):
+        if 'application/json' in response.headers.get('Content-Type', ''):
+            return await response.json()
         else:
-            self.globalRateLimitMessageReset -= 1
-        if retry_after:
-            await asyncio.sleep(int(retry_after) + 5)
+            return await response.text()
 
 
-    async def get(self, url: str, *, headers: dict = None, params: dict = None, retries: int = 7) -> dict:
-        async def adquire(response: object):
-            if 'application/json' in response.headers.get('Content-Type', ''):
-                return await response.json()
+    async def Dl_File(self, url: str, path: str, *, size: int = None, hashes: dict = None, chunk_size: int = 65536) -> int:
+        """Streams the file at url to path, chunk by chunk, so memory use does not depend on the file size.
+
+        The data goes to path + '.part', which is only renamed to path once complete. Next to it a small state file
+        (path + '.part.json') records the url, expected size, hash and ETag, so when a connection drops (or the whole run
+        is interrupted) the next attempt resumes where it stopped with a Range request, as long as it is the same file.
+        Servers that ignore the Range (or whose file changed, see If-Range) just send the whole file again.
+
+        Args:
+            size (int, optional): Expected size in bytes.
+            hashes (dict, optional): Expected hex digests keyed by algorithm, as published by the api. The file is hashed as the chunks
+                arrive (no second read, except for the part already on disk when resuming), and a download that does not match is
+                thrown away and retried from scratch.
+
+        Only one download per destination runs at a time, a second one to the same path (a repeated link, a project named
+        by slug and by id) shares the first one instead of racing it over the same part files.
+
+        Returns:
+            int: The size of the file.
+        """
+        return await self.client.inflight.do(('download', os.path.abspath(path)), lambda: self._Dl_File(url, path, size=size, hashes=hashes, chunk_size=chunk_size))
+
+
+    async def _Dl_File(self, url: str, path: str, *, size: int = None, hashes: dict = None, chunk_size: int = 65536) -> int:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        
+        if size is not None and size >= self.client.segment_threshold:
+            try:
+                return await self.Dl_Segmented(url, path, size, hashes=hashes, connections=self.client.segment_connections)
+            except (RangeNotSupportedError, HashMismatchError) as e:
+                print(f"Segmented download of {url} failed ({e}), downloading it in one piece")
+        
+        partPath = path + '.part'
+        statePath = partPath + '.json'
+        expected = pick_hash(hashes)
+        
+        def discard():
+            for leftover in (partPath, statePath):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        
+        def resumable() -> int:
+            """Bytes of the part already downloaded that can be kept, 0 (after discarding them) otherwise."""
+            try:
+                with open(statePath, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                offset = os.path.getsize(partPath)
+            except (OSError, ValueError):
+                discard()
+                return 0
+            
+            sameFile = state.get('url') == url and state.get('size') == size and state.get('hash') == (list(expected) if expected else None)
+            if not sameFile or offset == 0 or (size is not None and offset >= size):
+                discard()
+                return 0
+            return offset
+        
+        def requestHeaders() -> dict:
+            headers = {"Accept": "application/octet-stream"}
+            
+            offset = resumable()
+            if offset > 0:
+                headers['Range'] = f'bytes={offset}-'
+                with open(statePath, 'r', encoding='utf-8') as f:
+                    etag = json.load(f).get('etag')
+                if etag:
+                    headers['If-Range'] = etag
+            return headers
+        
+        async def download(response):
+            offset = 0
+            digest = hashlib.new(expected[0]) if expected else None
+            
+            if response.status == 206:
+                offset = resumable()
+                contentRange = response.headers.get('Content-Range', '')
+                if not contentRange.startswith(f'bytes {offset}-'):
+                    discard()
+                    raise HashMismatchError(f"Unexpected Content-Range from {url}: {contentRange}")
+                
+                if digest is not None:
+                    await asyncio.to_thread(self._hash_into, digest, partPath)
+            else:
+                with open(statePath, 'w', encoding='utf-8') as f:
+                    json.dump({'url': url, 'size': size, 'hash': list(expected) if expected else None, 'etag': response.headers.get('ETag')}, f)
+            
+            written = offset
+            async with async_writer(partPath, 'ab' if offset else 'wb') as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await f.write(chunk)
+                    written += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+            
+            # The part is kept on any other failure (dropped connection, interrupted run...), so the next attempt can resume it
+            try:
+                if size is not None and written != size:
+                    raise HashMismatchError(f"Expected {size} bytes from {url}, got {written}")
+                if digest is not None and digest.hexdigest() != expected[1]:
+                    raise HashMismatchError(f"{expected[0]} mismatch for {url}")
+            except HashMismatchError:
+                discard()
+                raise
+            
+            os.replace(partPath, path)
+            os.remove(statePath)
+            return written
+        
+        return await self._httpSafeGuards(url,  act = download, headers=requestHeaders, retries=5, kind='transfer')
+
+
+    async def Dl_Segmented(self, url: str, path: str, size: int, *, hashes: dict = None, connections: int = 4, min_segment: int = 1024 * 1024, max_segment: int = 32 * 1024 * 1024, segment_seconds: float = 2) -> int:
+        """Downloads a big file over several connections, each fetching Range segments and writing them at their offset in a
+        preallocated path + '.part'.
+
+        Segments are handed out from a shared list of missing ranges, and each connection sizes its next segment from the
+        throughput it measured on the last one (about segment_seconds worth of data), so fast connections take bigger pieces,
+        but never more than an even share of what is still missing.
+        Finished segments are recorded in the path + '.part.json' state file, an interrupted download only fetches the gaps.
+        Segments arrive out of order, so the hash is checked with a single read of the finished file.
+
+        Raises:
+            RangeNotSupportedError: The server does not honour Range requests (or the file changed), nothing was kept.
+            HashMismatchError: The assembled file does not match size/hashes, nothing was kept.
+
+        Returns:
+            int: The size of the file.
+        """
+        partPath = path + '.part'
+        statePath = partPath + '.json'
+        expected = pick_hash(hashes)
+        identity = {'url': url, 'size': size, 'hash': list(expected) if expected else None}
+        
+        def discard():
+            for leftover in (partPath, statePath, statePath + '.tmp'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        
+        def loadState() -> dict:
+            try:
+                with open(statePath, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if all(state.get(key) == value for key, value in identity.items()) and isinstance(state.get('segments'), list) and os.path.getsize(partPath) == size:
+                    return state
+            except (OSError, ValueError):
+                pass
+            
+            discard()
+            with open(partPath, 'wb') as f:
+                f.truncate(size) # Preallocated, every segment is written in place
+            return {**identity, 'etag': None, 'segments': []}
+        
+        def saveState(snapshot: str):
+            # Replaced whole, an interrupted write never leaves a truncated state behind
+            with open(statePath + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(snapshot)
+            os.replace(statePath + '.tmp', statePath)
+        
+        stateLock = asyncio.Lock() # One write at a time, so an older snapshot never lands after a newer one
+        
+        state = await asyncio.to_thread(loadState)
+        
+        pending = []
+        cursor = 0
+        for start, stop in sorted(state['segments']):
+            if start > cursor:
+                pending.append([cursor, start])
+            cursor = max(cursor, stop)
+        if cursor < size:
+            pending.append([cursor, size])
+        
+        def nextSegment(length: int) -> tuple[int, int] | None:
+            if len(pending) == 0:
+                return None
+            
+            # No more than an even share of what is left, so the other connections are not left idle
+            remaining = sum(end - start for start, end in pending)
+            length = min(length, max(min_segment, -(-remaining // connections)))
+            
+            start, end = pending[0]
+            stop = min(end, start + length)
+            if stop == end:
+                pending.pop(0)
             else:
-                return await response.text()
+                pending[0][0] = stop
+            return start, stop
+        
+        def writeAt(handle: object, offset: int, data: bytes):
+            handle.seek(offset)
+            handle.write(data)
+        
+        async def fetch(handle: object, start: int, stop: int) -> float:
+            """Downloads one segment, returns the seconds it took (not counting the wait for a slot)."""
+            elapsed = 0
+            
+            def headers() -> dict:
+                headers = {"Accept": "application/octet-stream", 'Range': f'bytes={start}-{stop - 1}'}
+                if state['etag']:
+                    headers['If-Range'] = state['etag']
+                return headers
             
-        return await self._httpSafeGuards(url, act = adquire, headers=headers,  params=params, retries=retries)
+            async def write(response):
+                nonlocal elapsed
+                began = time.monotonic()
+                
+                if response.status != 206:
+                    raise RangeNotSupportedError(f"{url} answered a Range request with {response.status}")
+                if not response.headers.get('Content-Range', '').startswith(f'bytes {start}-'):
+                    raise HashMismatchError(f"Unexpected Content-Range from {url}: {response.headers.get('Content-Range')}")
+                
+                state['etag'] = state['etag'] or response.headers.get('ETag')
+                
+                offset = start
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(65536):
+                    buffer += chunk
+                    if len(buffer) >= min_segment:
+                        await asyncio.to_thread(writeAt, handle, offset, bytes(buffer))
+                        offset += len(buffer)
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(writeAt, handle, offset, bytes(buffer))
+                    offset += len(buffer)
+                
+                if offset != stop:
+                    raise HashMismatchError(f"Segment {start}-{stop - 1} of {url} came back with {offset - start} bytes")
+                elapsed = time.monotonic() - began
+            
+            await self._httpSafeGuards(url, act = write, headers=headers, retries=5, kind='transfer')
+            return elapsed
+        
+        async def worker(length: int, *, once: bool = False) -> int:
+            """Fetches segments until none are left (or just one, with once), returns the segment length it would ask for next."""
+            handle = await asyncio.to_thread(open, partPath, 'r+b') # One handle per connection, so seeks do not race
+            try:
+                while (segment := nextSegment(length)) is not None:
+                    start, stop = segment
+                    elapsed = await fetch(handle, start, stop)
+                    
+                    state['segments'].append([start, stop])
+                    async with stateLock:
+                        await asyncio.to_thread(saveState, json.dumps(state))
+                    
+                    length = int(min(max_segment, max(min_segment, (stop - start) / max(elapsed, 0.001) * segment_seconds)))
+                    if once:
+                        break
+            finally:
+                await asyncio.to_thread(handle.close)
+            return length
+        
+        try:
+            # A lone first segment finds out whether ranges are honoured before more connections are opened
+            length = await worker(4 * min_segment, once=True)
+            
+            tasks = [asyncio.ensure_future(worker(length)) for _ in range(connections)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        except (RangeNotSupportedError, HashMismatchError):
+            await asyncio.to_thread(discard)
+            raise
+        
+        if expected and not await asyncio.to_thread(file_matches, partPath, size, hashes):
+            await asyncio.to_thread(discard)
+            raise HashMismatchError(f"{expected[0]} mismatch for {url}")
+        
+        os.replace(partPath, path)
+        os.remove(statePath)
+        return size
 
 
-    async def Dl_Data(self, url: str) -> bytes:
-        async def download(response):
-            return await response.read()
+    @staticmethod
+    def _hash_into(digest: object, path: str, chunk_size: int = 1024 * 1024):
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+
+
+
+    def cache_lookup(self, url: str, params: dict = None) -> any:
+        """Returns the fresh cached response for url, None if there is none (or no cache).
+        Raises Http404Error if url is cached as missing.
+        """
+        responseCache = self.client.cache
+        if responseCache is None:
+            return None
+        
+        entry = responseCache.get(responseCache.key(url, params))
+        if entry is None or not entry.fresh:
+            return None
         
-        return await self._httpSafeGuards(url,  act = download, headers={"Accept": "application/octet-stream"}, retries=5)
+        if entry.missing:
+            raise Http404Error(f"Not found (cached): {url}")
+        return entry.data
+
+
+    def cache_store(self, url: str, data: any, params: dict = None):
+        """Caches data as if it was the response of url, used to split bulk responses into single entries."""
+        responseCache = self.client.cache
+        if responseCache is not None and responseCache.cacheable(url):
+            responseCache.put(responseCache.key(url, params), url, data)
+
+
+    def cache_missing(self, url: str, params: dict = None):
+        """Remembers that url does not exist, so it is not looked up again until the entry expires."""
+        responseCache = self.client.cache
+        if responseCache is not None and responseCache.cacheable(url):
+            responseCache.put_missing(responseCache.key(url, params), url)
+
+
+    def chunk_ids(self, ids: list, max_length: int = 3000) -> list[list]:
+        """Splits ids into chunks small enough for their json list to fit in a query string of max_length characters.
+        """
+        chunks = []
+        current = []
+        length = len(quote('[]'))
+        
+        for id in ids:
+            size = len(quote(json.dumps(id) + ', '))
+            if current and length + size > max_length:
+                chunks.append(current)
+                current = []
+                length = len(quote('[]'))
+                
+            current.append(id)
+            length += size
+            
+        if current:
+            chunks.append(current)
+        return chunks
 
 
-    async def format_query(self, query: str):
+    def format_query(self, query: str):
         formattedQuery = [f'"{x}"' for x in query]
         return ','.join(formattedQuery)
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Memo.py
+
+import asyncio
+
+from typing import Awaitable, Callable, Hashable
+
+
+class Memo:
+    """Remembers the result of async lookups for the rest of the run.
+
+    Concurrent calls with the same key share one in-flight lookup, and later calls get the stored result right away.
+    Failures are not remembered, the next call tries again.
+    """
+
+    def __init__(self) -> None:
+        self._results = {}
+        self._inflight = {}
+
+
+    async def get(self, key: Hashable, factory: Callable[[], Awaitable]) -> any:
+        if key in self._results:
+            return self._results[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._settle(key, done))
+
+        # Shielded, so one caller giving up does not cancel the lookup for everyone else
+        return await asyncio.shield(task)
+
+
+    def _settle(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._results[key] = task.result()
+
+
+    def clear(self):
+        self._results.clear()
+
+
+
+class SingleFlight:
+    """Shares one in-flight call between identical concurrent requests, nothing is kept once it completes.
+    """
+
+    def __init__(self) -> None:
+        self._inflight = {}
+
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable]) -> any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None))
+
+        return await asyncio.shield(task)
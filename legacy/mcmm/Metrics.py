@@ -0,0 +1,211 @@
+# Metrics.py
+
+import json
+import os
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+
+class RequestTrace:
+    """What happened to a single request, from the first rate limit wait to the last retry. Filled by utils._httpSafeGuards."""
+
+    def __init__(self, metrics: 'Metrics', method: str, url: str, endpoint: str, kind: str, cache: str = None) -> None:
+        self.metrics = metrics
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.kind = kind
+        self.cache = cache
+
+        self.status = None
+        self.bytes = 0
+        self.attempts = 0
+        self.rate_limit_wait = 0
+        self.queue_wait = 0
+        self.started = time.monotonic()
+
+
+    def finish(self):
+        ended = time.monotonic()
+        self.metrics.add({
+            'method': self.method,
+            'host': urlsplit(self.url).hostname,
+            'endpoint': self.endpoint,
+            'kind': self.kind,
+            'status': self.status,
+            'latency': ended - self.started - self.rate_limit_wait - self.queue_wait,
+            'rate_limit_wait': self.rate_limit_wait,
+            'queue_wait': self.queue_wait,
+            'bytes': self.bytes,
+            'retries': max(self.attempts - 1, 0),
+            'cache': 'revalidated' if self.status == 304 else self.cache,
+            'start': self.started - self.metrics.started,
+            'end': ended - self.metrics.started
+        })
+
+
+
+class Metrics:
+    """Per request records of every http call (and response cache hit) of a run, and the summaries made out of them.
+
+    Collecting is always on (it is a dict per request), writing the summary, trace or Prometheus textfile is up to the caller.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self) -> None:
+        self.records = []
+        self.counters = Counter()
+        self.started = time.monotonic()
+
+
+    def start(self):
+        """Restarts the wall clock, the records made so far are kept."""
+        self.started = time.monotonic()
+
+
+    def trace(self, method: str, url: str, endpoint: str, *, kind: str = 'metadata', cache: str = None) -> RequestTrace:
+        """Starts the record of a request, endpoint being its class (see HttpClient.endpoint_class)."""
+        return RequestTrace(self, method, url, endpoint, kind, cache)
+
+
+    def add(self, record: dict):
+        self.records.append(record)
+
+
+    def cache_hit(self, url: str, endpoint: str):
+        now = time.monotonic() - self.started
+        self.add({
+            'method': 'GET', 'host': urlsplit(url).hostname, 'endpoint': endpoint, 'kind': 'metadata', 'status': None,
+            'latency': 0, 'rate_limit_wait': 0, 'queue_wait': 0, 'bytes': 0, 'retries': 0, 'cache': 'hit', 'start': now, 'end': now
+        })
+
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+
+
+    @staticmethod
+    def quantile(values: list[float], q: float) -> float:
+        """Nearest rank quantile of already sorted values."""
+        if len(values) == 0:
+            return 0
+        return values[min(len(values) - 1, max(0, round(q * len(values) + 0.5) - 1))]
+
+
+    @staticmethod
+    def busy_time(intervals: list[tuple[float, float]]) -> float:
+        """Wall time covered by at least one of the intervals (overlapping requests only count once)."""
+        total = 0
+        end = None
+        for start, stop in sorted(intervals):
+            if end is None or start > end:
+                total += stop - start
+                end = stop
+            elif stop > end:
+                total += stop - end
+                end = stop
+        return total
+
+
+
+    def summary(self) -> dict:
+        """Totals for the run: latency quantiles per endpoint, bytes, cache use, and the wall time split into resolve
+        (api calls), transfer (downloads) and wait (rate limits and queueing for a slot).
+        """
+        requests = [record for record in self.records if record['cache'] != 'hit']
+
+        endpoints = {}
+        byEndpoint = defaultdict(list)
+        for record in requests:
+            byEndpoint[record['endpoint']].append(record)
+
+        for endpoint, records in sorted(byEndpoint.items()):
+            latencies = sorted(record['latency'] for record in records)
+            endpoints[endpoint] = {
+                'count': len(records),
+                'bytes': sum(record['bytes'] for record in records),
+                'retries': sum(record['retries'] for record in records),
+                **{f'p{round(q * 100)}': round(self.quantile(latencies, q), 4) for q in self.QUANTILES},
+                'max': round(latencies[-1], 4)
+            }
+
+        def phase(kind: str) -> float:
+            return self.busy_time([(record['end'] - record['latency'], record['end']) for record in requests if record['kind'] == kind])
+
+        waits = [(record['start'], record['start'] + record['rate_limit_wait'] + record['queue_wait']) for record in requests]
+
+        return {
+            'wall_time': round(time.monotonic() - self.started, 3),
+            'phases': {
+                'resolve': round(phase('metadata'), 3),
+                'transfer': round(phase('transfer'), 3),
+                'wait': round(self.busy_time(waits), 3)
+            },
+            'requests': len(requests),
+            'bytes': sum(record['bytes'] for record in requests),
+            'retries': sum(record['retries'] for record in requests),
+            'rate_limit_wait': round(sum(record['rate_limit_wait'] for record in requests), 3),
+            'cache': dict(Counter(record['cache'] for record in self.records if record['cache'])),
+            'status': {str(status): count for status, count in Counter(record['status'] for record in requests).items()},
+            'hosts': dict(Counter(record['host'] for record in requests)),
+            'endpoints': endpoints,
+            'counters': dict(self.counters)
+        }
+
+
+
+    def prometheus(self) -> str:
+        """The summary in the Prometheus text exposition format, for the node_exporter textfile collector."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: list[tuple[dict, float]]):
+            lines.append(f'# HELP mcmm_{name} {help}')
+            lines.append(f'# TYPE mcmm_{name} {kind}')
+            for labels, value in samples:
+                labelText = ','.join(f'{key}="{labelValue}"' for key, labelValue in labels.items())
+                lines.append(f'mcmm_{name}{{{labelText}}} {value}' if labelText else f'mcmm_{name} {value}')
+
+        endpoints = summary['endpoints'].items()
+        metric('wall_time_seconds', 'gauge', 'Wall time of the last run.', [({}, summary['wall_time'])])
+        metric('phase_seconds', 'gauge', 'Wall time spent resolving, transferring and waiting.', [({'phase': phase}, value) for phase, value in summary['phases'].items()])
+        metric('requests_total', 'counter', 'Http requests made, by endpoint class.', [({'endpoint': endpoint}, stats['count']) for endpoint, stats in endpoints])
+        metric('bytes_total', 'counter', 'Response bytes received, by endpoint class.', [({'endpoint': endpoint}, stats['bytes']) for endpoint, stats in endpoints])
+        metric('retries_total', 'counter', 'Retried attempts, by endpoint class.', [({'endpoint': endpoint}, stats['retries']) for endpoint, stats in endpoints])
+        metric('request_latency_seconds', 'gauge', 'Request latency quantiles, by endpoint class.', [
+            ({'endpoint': endpoint, 'quantile': str(q)}, stats[f'p{round(q * 100)}']) for endpoint, stats in endpoints for q in self.QUANTILES
+        ])
+        metric('cache_total', 'counter', 'Api response cache results.', [({'result': result}, count) for result, count in summary['cache'].items()])
+        metric('rate_limit_wait_seconds', 'counter', 'Time requests spent waiting on rate limits.', [({}, summary['rate_limit_wait'])])
+
+        return '\n'.join(lines) + '\n'
+
+
+
+    def write_summary(self, path: str):
+        self._write(path, json.dumps(self.summary(), indent=2))
+
+
+    def write_trace(self, path: str):
+        """One json record per line, per request."""
+        self._write(path, ''.join(json.dumps(record) + '\n' for record in self.records))
+
+
+    def write_prometheus(self, path: str):
+        self._write(path, self.prometheus())
+
+
+    def _write(self, path: str, text: str):
+        # Written next to the target and renamed, a textfile collector must never read a half written file
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tempPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tempPath, path)
@@ -0,0 +1,181 @@
+# RateLimiter.py
+
+import asyncio
+import time
+
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """Paces the requests made to a single host.
+
+    The bucket learns the budget from the X-Ratelimit-* headers of every response, and spreads the remaining requests
+    over the time left until the window resets. Once the budget runs out every waiter sleeps on one shared future,
+    instead of each coroutine sleeping on its own after getting a 429.
+    Until a response arrives the bucket refills at a guessed rate (burst tokens every default_penalty seconds), so a
+    host that never answers fails its requests through their retries instead of holding them.
+    """
+
+    def __init__(self, *, burst: int = 10, default_penalty: float = 5) -> None:
+        self.burst = burst
+        self.default_penalty = default_penalty
+
+        self.metered = None # Unknown until the first response, False if the host does not send rate limit headers
+        self.rate = None # tokens per second
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+        self._blocked = None
+        self._blocked_until = 0
+        self._learned = None
+
+
+    @property
+    def blocked(self) -> bool:
+        return self._blocked is not None
+
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+
+    async def acquire(self):
+        while True:
+            if self._blocked is not None:
+                await asyncio.shield(self._blocked)
+                continue
+
+            if self.metered is False:
+                return
+
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            if self.metered is None and self.rate is None:
+                # The first burst is spent and the budget is still unknown, wait (a while) for the first response to tell it
+                if self._learned is None:
+                    self._learned = asyncio.get_running_loop().create_future()
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._learned), self.default_penalty)
+                except asyncio.TimeoutError:
+                    self._guess()
+                continue
+
+            self.block((1 - self.tokens) / self.rate)
+
+
+
+    def block(self, delay: float, *, message: str = None):
+        """Holds every caller of acquire until delay seconds have passed (only extends an ongoing block)."""
+        loop = asyncio.get_running_loop()
+        until = time.monotonic() + delay
+
+        if self._blocked is not None and until <= self._blocked_until:
+            return
+
+        if message and self._blocked is None:
+            print(message)
+
+        previous = self._blocked
+        self._blocked = loop.create_future()
+        self._blocked_until = until
+        loop.call_later(delay, self._release, self._blocked)
+
+        if previous is not None and not previous.done():
+            previous.set_result(None) # Its waiters loop back and wait on the new, longer block
+
+
+    def _release(self, future: asyncio.Future):
+        if self._blocked is future:
+            self._blocked = None
+        if not future.done():
+            future.set_result(None)
+
+
+
+    def update(self, headers: dict):
+        """Syncs the bucket with the budget the server reports."""
+        limit = headers.get('X-Ratelimit-Limit')
+        remaining = headers.get('X-Ratelimit-Remaining')
+        reset = headers.get('X-Ratelimit-Reset')
+
+        if limit is None or remaining is None or reset is None:
+            if self.metered is None:
+                self.metered = False
+                self._learn()
+            return
+
+        limit, remaining, reset = int(limit), int(remaining), max(float(reset), 1)
+
+        self.metered = True
+        self._learn()
+
+        self._refill()
+        self.capacity = max(1, min(self.burst, limit))
+        self.tokens = min(self.tokens, remaining)
+        self.rate = max(remaining, 1) / reset
+
+        if remaining <= 0:
+            self.block(reset)
+
+
+
+    def unanswered(self):
+        """Called when an attempt ended without a response (refused, unresolved, timed out). While the budget is still
+        unknown, the bucket stops waiting for a response and refills at the guessed rate.
+        """
+        if self.metered is None:
+            self._guess()
+
+
+    def _guess(self):
+        if self.rate is None:
+            self._refill()
+            self.rate = self.burst / self.default_penalty
+        self._learn()
+
+
+    def _learn(self):
+        if self._learned is not None and not self._learned.done():
+            self._learned.set_result(None)
+        self._learned = None
+
+
+
+    def limited(self, headers: dict):
+        """Called on a 429, blocks the host until the window resets."""
+        reset = headers.get('X-Ratelimit-Reset') or headers.get('Retry-After')
+        delay = float(reset) + 1 if reset else self.default_penalty
+
+        self.tokens = 0
+        self.block(delay, message='Too many requests, please wait...')
+
+
+
+class RateLimiter:
+    """One TokenBucket per host."""
+
+    def __init__(self, *, burst: int = 10) -> None:
+        self.burst = burst
+
+        self._buckets = {}
+        self._loop = None
+
+
+    def bucket(self, url: str) -> TokenBucket:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop: # Pending futures belong to the loop they were created in
+            self._buckets = {}
+            self._loop = loop
+
+        host = urlsplit(url).hostname or ''
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(burst=self.burst)
+        return self._buckets[host]
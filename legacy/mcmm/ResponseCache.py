@@ -0,0 +1,179 @@
+# ResponseCache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from mcmm.HttpClient import endpoint_class
+
+
+class CacheEntry:
+    def __init__(self, data: any, etag: str | None, last_modified: str | None, fresh: bool, missing: bool = False) -> None:
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+        self.missing = missing
+
+
+    def validators(self) -> dict:
+        """Conditional request headers, so the server can answer 304 instead of resending the body."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+
+class ResponseCache:
+    """Persistent api response cache, stored in a SQLite database.
+
+    Entries are keyed by url and query parameters, each endpoint class has its own time to live, and stale entries
+    keep their ETag/Last-Modified so they can be revalidated instead of downloaded again.
+    Urls known not to exist are remembered too (negative entries), so missing slugs and ids cost nothing until they expire.
+    The least recently used entries are evicted once the database grows past max_bytes. Access times of cache hits are
+    kept in memory and written in one transaction at eviction, so hits never wait on a disk write.
+    """
+
+    MISSING = 'missing'
+
+    # Seconds, per endpoint class (see HttpClient.endpoint_class)
+    TTLS = {
+        'project': 6 * 3600,
+        'versions': 3600,
+        'version': 7 * 24 * 3600,
+        'search': 24 * 3600,
+        'files': 3600,
+        'file': 7 * 24 * 3600,
+        'games': 24 * 3600,
+        MISSING: 24 * 3600
+    }
+
+    def __init__(self, path: str, *, max_bytes: int = 64 * 1024 * 1024, ttls: dict = None) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = {**self.TTLS, **(ttls or {})}
+
+        self._db = None
+        self._accessed = {} # key -> access time not yet written
+
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT,
+                    body TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    stored REAL,
+                    accessed REAL,
+                    size INTEGER
+                )""")
+        return self._db
+
+
+
+    def key(self, url: str, params: dict = None) -> str:
+        raw = json.dumps([url, sorted((params or {}).items())], default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+
+    def cacheable(self, url: str) -> bool:
+        return endpoint_class(url) in self.ttls
+
+
+
+    def get(self, key: str) -> CacheEntry | None:
+        row = self.db.execute('SELECT endpoint, body, etag, last_modified, stored FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        endpoint, body, etag, last_modified, stored = row
+        now = time.time()
+        self._accessed[key] = now
+
+        fresh = now - stored < self.ttls.get(endpoint, 0)
+        return CacheEntry(json.loads(body), etag, last_modified, fresh, endpoint == self.MISSING)
+
+
+
+    def put(self, key: str, url: str, data: any, *, etag: str = None, last_modified: str = None):
+        body = json.dumps(data)
+        now = time.time()
+        self._accessed.pop(key, None)
+
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, endpoint_class(url), body, etag, last_modified, now, now, len(body))
+            )
+
+
+
+    def put_missing(self, key: str, url: str):
+        now = time.time()
+        self._accessed.pop(key, None)
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, self.MISSING, 'null', None, None, now, now, 4)
+            )
+
+
+
+    def revalidated(self, key: str):
+        """Marks an entry as fresh again, after the server answered 304 Not Modified."""
+        now = time.time()
+        self._accessed.pop(key, None)
+        with self.db:
+            self.db.execute('UPDATE responses SET stored = ?, accessed = ? WHERE key = ?', (now, now, key))
+
+
+
+    def evict(self):
+        """Writes the pending access times, then drops the least recently used entries until the cache fits in max_bytes."""
+        if self._accessed:
+            with self.db:
+                self.db.executemany('UPDATE responses SET accessed = ? WHERE key = ?', [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed = {}
+
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        freed = 0
+        victims = []
+        for key, size in self.db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+
+        with self.db:
+            self.db.executemany('DELETE FROM responses WHERE key = ?', victims)
+
+
+
+    def clear(self):
+        self._accessed = {}
+        with self.db:
+            self.db.execute('DELETE FROM responses')
+
+
+    def close(self):
+        if self._db is not None:
+            self.evict()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,29 @@
+# RetryPolicy.py
+
+import asyncio
+import random
+import aiohttp
+
+
+class RetryPolicy:
+    """Decides which failures are worth another attempt, and how long to wait before it.
+
+    Only transient failures (5xx, dropped connections, timeouts) are retried, with exponential backoff and full jitter
+    so a batch of failed requests does not come back all at the same time. A 404 is definitive and is never retried.
+    """
+
+    TRANSIENT_STATUSES = {408, 500, 502, 503, 504, 520, 521, 522, 523, 524}
+    TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+    def __init__(self, *, base_delay: float = 0.5, max_delay: float = 30) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+
+    def is_transient(self, status: int) -> bool:
+        return status in self.TRANSIENT_STATUSES
+
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retrying, attempt being how many attempts already failed."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
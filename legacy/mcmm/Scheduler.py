@@ -0,0 +1,99 @@
+# Scheduler.py
+
+import asyncio
+
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Iterable, Literal
+from urllib.parse import urlsplit
+
+
+class Scheduler:
+    """Bounds how much http work runs at the same time.
+
+    Requests are capped per host group (Modrinth api, Curseforge api, CDNs) and per kind of work, metadata calls and
+    file transfers wait on separate queues so a batch of big downloads does not starve the api lookups (and vice versa).
+    """
+
+    HOST_GROUPS = {
+        'api.modrinth.com': 'modrinth',
+        'api.curseforge.com': 'curseforge',
+        'cdn.modrinth.com': 'cdn',
+        'edge.forgecdn.net': 'cdn',
+        'media.forgecdn.net': 'cdn',
+        'mediafilez.forgecdn.net': 'cdn'
+    }
+
+    def __init__(self, *, workers: int = 16, metadata_slots: int = 24, transfer_slots: int = 8, modrinth_connections: int = 8, curseforge_connections: int = 8, cdn_connections: int = 12, other_connections: int = 4) -> None:
+        self.workers = workers
+        self.limits = {
+            'metadata': metadata_slots,
+            'transfer': transfer_slots,
+            'modrinth': modrinth_connections,
+            'curseforge': curseforge_connections,
+            'cdn': cdn_connections,
+            'other': other_connections
+        }
+
+        self._semaphores = {}
+        self._loop = None
+
+
+    def configure(self, *, workers: int = None, **limits: int):
+        """Overrides the worker count and/or any of the limits, only effective before the scheduler is first used.
+        """
+        if workers:
+            self.workers = workers
+
+        for name, value in limits.items():
+            if value:
+                self.limits[name] = value
+
+
+
+    def host_group(self, url: str) -> str:
+        host = urlsplit(url).hostname or ''
+        return self.HOST_GROUPS.get(host, 'other')
+
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop: # Semaphores get bound to the loop they are first used in
+            self._semaphores = {}
+            self._loop = loop
+            
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.limits[name])
+        return self._semaphores[name]
+
+
+
+    @asynccontextmanager
+    async def slot(self, kind: Literal['metadata', 'transfer'], url: str):
+        """Waits for a free slot for this kind of work and for the host of url, holding both until the block exits.
+        """
+        async with self._semaphore(kind):
+            async with self._semaphore(self.host_group(url)):
+                yield
+
+
+
+    async def map(self, func: Callable[[any], Awaitable], items: Iterable) -> list:
+        """Runs func over every item using a fixed pool of workers, instead of starting everything at once.
+
+        Returns:
+            list: The results, in the same order as items.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        queue = asyncio.Queue()
+
+        for index, item in enumerate(items):
+            queue.put_nowait((index, item))
+
+        async def worker():
+            while not queue.empty():
+                index, item = queue.get_nowait()
+                results[index] = await func(item)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(items)))))
+        return results
@@ -1,7 +1,12 @@
+import asyncio
+import codecs
 import configparser
+import hashlib
 import json
 import os
 
+from typing import AsyncIterator
+
 class cache:
     def __init__(self, cache_file_path) -> None:
         self.cache_file_path = cache_file_path
@@ -106,6 +111,154 @@ class general:
             return None
 
 
+
+class async_writer:
+    """Writes a file from async code without blocking the event loop.
+    
+    Every write runs in a worker thread, and a write is only awaited when the next one is issued, so the disk write of a chunk overlaps with receiving the next one.
+    """
+    def __init__(self, path: str, mode: str = 'wb') -> None:
+        self.path = path
+        self.mode = mode
+        self.file = None
+        self._pending = None
+
+
+    async def __aenter__(self):
+        self.file = await asyncio.to_thread(open, self.path, self.mode)
+        return self
+
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+    async def write(self, data: bytes):
+        if self._pending is not None:
+            await self._pending
+        self._pending = asyncio.ensure_future(asyncio.to_thread(self.file.write, data))
+
+
+    async def close(self):
+        if self.file is None:
+            return
+        try:
+            if self._pending is not None:
+                await self._pending
+        finally:
+            self._pending = None
+            await asyncio.to_thread(self.file.close)
+            self.file = None
+
+
+
+def hash_file(path: str, algorithm: str = 'sha1', *, chunk_size: int = 1024 * 1024) -> str:
+    """Hex digest of a file, read in chunks. Blocking, run it in a thread from async code.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+HASH_PREFERENCE = ('sha1', 'sha512', 'md5') # Cheapest first
+
+def pick_hash(hashes: dict) -> tuple[str, str] | None:
+    """The (algorithm, hex digest) to check a file against, out of the hashes an api publishes for it. None if there is none usable."""
+    for algorithm in HASH_PREFERENCE:
+        if (hashes or {}).get(algorithm):
+            return algorithm, hashes[algorithm].lower()
+    return None
+
+
+def file_matches(path: str, size: int = None, hashes: dict = None) -> bool:
+    """Whether the file at path has the given size and hash. Blocking, run it in a thread from async code.
+    """
+    expected = pick_hash(hashes)
+    if expected is None or not os.path.exists(path):
+        return False
+    
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    
+    return hash_file(path, expected[0]) == expected[1]
+
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[any]:
+    """Decodes a top level json array item by item, as its bytes arrive.
+    Only the item being decoded (and one network chunk) is held in memory, instead of the whole document.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = aiter(chunks)
+    
+    buffer = ''
+    pos = 0
+    started = eof = False
+    
+    async def readMore(atLeast: int):
+        nonlocal buffer, pos, eof
+        buffer = buffer[pos:]
+        pos = 0
+        
+        # Grows geometrically, so an item bigger than a chunk is not re-decoded once per chunk
+        added = 0
+        while added < atLeast and not eof:
+            try:
+                text = utf8.decode(await anext(chunks))
+            except StopAsyncIteration:
+                text = utf8.decode(b'', final=True)
+                eof = True
+            buffer += text
+            added += len(text)
+    
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of json array")
+            await readMore(1)
+            continue
+        
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError("Expected a json array")
+            started = True
+            pos += 1
+            continue
+        
+        if buffer[pos] == ']':
+            return
+        
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            await readMore(max(len(buffer) - pos, 1))
+            continue
+        
+        # A number cut by the end of the buffer decodes fine ('12' of '12345', '1' of '1.5'), only the delimiter after it shows it is whole
+        after = end
+        while after < len(buffer) and buffer[after] in ' \t\r\n':
+            after += 1
+        
+        if after >= len(buffer) or buffer[after] not in ',]':
+            if not eof:
+                await readMore(1)
+                continue
+            if after < len(buffer):
+                raise ValueError(f"Expected ',' or ']' after a json array item, got {buffer[after]!r}")
+        
+        pos = end
+        yield item
+
+
 # Testing
 if __name__ == '__main__':
     configPath = os.path.join(os.path.dirname(__file__), "config") # Configs dir path
@@ -6,23 +6,32 @@ import argparse
 import asyncio
 import subprocess
 import os
+import re
+import sqlite3
 import sys
 
+from typing import TYPE_CHECKING
+
 
 # Imports custom classes
-from mcmm.MCModDownloader import MCModDownloader
-from mcmm.MCM_Utils import MCM_Utils
-from mcmm.MCSiteAPI import ModrinthAPI, CurseforgeAPI
+# The network side (aiohttp and everything built on it) is imported on first use, so config and review commands start instantly
+from mcmm.Lockfile import LOCKFILE_NAME
 from helpers import cache, config, general
 
+if TYPE_CHECKING:
+    from mcmm.MCModDownloader import MCModDownloader
+    from mcmm.HttpClient import HttpClient
+    from mcmm.DependencyResolver import DependencyResolver
+    from mcmm.Crosswalk import Crosswalk
 
-# TODO: Use a form of cache to store info about downloaded mods so that there is no need to make rpeated API calls on the dependency checking part (besides just being generally faster)
-mod_data_cache = []
 
 configPath = os.path.join(os.path.dirname(__file__), "config") # Configs dir path
 
 configFile = os.path.join(configPath, 'config.ini') # Config.ini path
 cacheFile = os.path.join(configPath, 'MCMM_Cache.json') # MCMM_Cache.json path
+blacklistFile = os.path.join(configPath, 'MCMM_Blacklist.json') # Dependencies ignored by the missing dependency checks
+responseCacheFile = os.path.join(configPath, 'MCMM_Responses.sqlite') # Persistent api response cache
+crosswalkFile = os.path.join(configPath, 'MCMM_Crosswalk.sqlite') # Modrinth <-> Curseforge id index
 
 app_config = config(configFile, default_structure={
     'Curseforge': {
@@ -34,11 +43,32 @@ app_config = config(configFile, default_structure={
     },
     'Other': {
         'prioritize_CF': 'False'
+    },
+    'Network': {
+        'timeout': '60',
+        'connect_timeout': '15',
+        'connections_per_host': '16',
+        'dns_cache_ttl': '300',
+        'workers': '16',
+        'metadata_slots': '24',
+        'transfer_slots': '8',
+        'modrinth_connections': '8',
+        'curseforge_connections': '8',
+        'cdn_connections': '12',
+        'segment_threshold_mb': '64',
+        'segment_connections': '4'
+    },
+    'Cache': {
+        'enabled': 'True',
+        'max_size_mb': '64'
     }
 }, allow_no_value=True)
 
 
 app_cache = cache(cacheFile)
+app_cache.setup()
+app_blacklist = cache(blacklistFile)
+app_blacklist.setup()
 _general = general()
 
 
@@ -59,11 +89,78 @@ def open_file_and_wait(path: str):
         subprocess.Popen([opener, path]).communicate()
 
 
-# Creating Class instances
-MCMD = MCModDownloader()
-MRAPI = ModrinthAPI()
-CFAPI = CurseforgeAPI()
-MCUtils = MCM_Utils()
+def fetch_blacklist() -> set:
+    return set(app_blacklist.cache('dependencies') or [])
+
+def build_resolver() -> 'DependencyResolver':
+    from mcmm.DependencyResolver import DependencyResolver
+    return DependencyResolver(get_downloader(), prioritize_cf=app_config['Other']['prioritize_cf'] == 'True', blacklist=fetch_blacklist())
+
+
+def build_http_client() -> 'HttpClient':
+    from mcmm.HttpClient import HttpClient
+    from mcmm.Scheduler import Scheduler
+    from mcmm.ResponseCache import ResponseCache
+    
+    network = app_config['Network']
+    
+    scheduler = Scheduler(
+        workers=network.getint('workers'),
+        metadata_slots=network.getint('metadata_slots'),
+        transfer_slots=network.getint('transfer_slots'),
+        modrinth_connections=network.getint('modrinth_connections'),
+        curseforge_connections=network.getint('curseforge_connections'),
+        cdn_connections=network.getint('cdn_connections')
+    )
+    
+    responseCache = None
+    if app_config['Cache'].getboolean('enabled'):
+        responseCache = ResponseCache(responseCacheFile, max_bytes=app_config['Cache'].getint('max_size_mb') * 1024 * 1024)
+    
+    return HttpClient(
+        timeout=network.getfloat('timeout'),
+        connect_timeout=network.getfloat('connect_timeout'),
+        connections_per_host=network.getint('connections_per_host'),
+        dns_cache_ttl=network.getint('dns_cache_ttl'),
+        segment_threshold=network.getint('segment_threshold_mb') * 1024 * 1024,
+        segment_connections=network.getint('segment_connections'),
+        scheduler=scheduler,
+        cache=responseCache
+    )
+
+
+async def with_http_client(coro):
+    """Awaits the coroutine, then closes the pooled http session (it is bound to the current event loop) and the id index.
+    """
+    try:
+        return await coro
+    finally:
+        if 'http_client' in _instances:
+            await _instances['http_client'].close()
+        if 'crosswalk' in _instances:
+            _instances['crosswalk'].close()
+
+
+# Class instances, created on first use
+_instances = {}
+
+def get_http_client() -> 'HttpClient':
+    if 'http_client' not in _instances:
+        _instances['http_client'] = build_http_client()
+    return _instances['http_client']
+
+def get_crosswalk() -> 'Crosswalk':
+    if 'crosswalk' not in _instances:
+        from mcmm.Crosswalk import Crosswalk
+        _instances['crosswalk'] = Crosswalk(crosswalkFile)
+    return _instances['crosswalk']
+
+def get_downloader() -> 'MCModDownloader':
+    """The downloader every command shares, with its API objects, so batching and per run memos cover every lookup."""
+    if 'downloader' not in _instances:
+        from mcmm.MCModDownloader import MCModDownloader
+        _instances['downloader'] = MCModDownloader(client=get_http_client(), crosswalk=get_crosswalk())
+    return _instances['downloader']
 
 
 async def main(mainArguments: argparse.Namespace) -> None:
@@ -73,6 +170,7 @@ async def main(mainArguments: argparse.Namespace) -> None:
         mainArguments (argparse.Namespace): Parsed arguments
     """
     app_cache.clearCache()
+    MCMD = get_downloader()
     
     successful = []
     failed = []
@@ -101,11 +199,32 @@ async def main(mainArguments: argparse.Namespace) -> None:
     elif mainArguments.mod_list is not None:
         successful, failed, dependencyIdList, downloadedIdList = await MCMD.multi_download(mainArguments.mod_list, parameters, mainArguments.output)
 
+    elif mainArguments.update:
+        successful, failed, dependencyIdList, downloadedIdList = await MCMD.update_mods(parameters, mainArguments.output)
+
+    elif mainArguments.install_locked is not None:
+        lockPath = mainArguments.install_locked or os.path.join(mainArguments.output, LOCKFILE_NAME)
+        successful, failed, dependencyIdList, downloadedIdList = await MCMD.install_locked(lockPath, mainArguments.output)
+
     else:
         successful, failed, dependencyIdList, downloadedIdList = await MCMD.txt_download(mainArguments.mod_list_txt, parameters, mainArguments.output)
 
     resultsPath = os.path.join(mainArguments.output, "results")
     os.makedirs(resultsPath, exist_ok=True)
+    
+    missingDependencies = []
+    installed = {id['data'] for id in downloadedIdList}
+    
+    if len(dependencyIdList) > 0:
+        print("dependencies detected, checking for any missing")
+        
+        resolver = build_resolver()
+        missingDependencies = resolver.missing(await resolver.equivalents(resolver.required(dependencyIdList)), installed)
+        
+        if len(missingDependencies) > 0 and mainArguments.resolve:
+            resolved, unresolved, missingDependencies = await resolver.download(missingDependencies, installed, parameters, mainArguments.output)
+            successful += resolved
+            failed += unresolved
 
     if len(successful) > 0:
         successfulPath = os.path.join(resultsPath, 'Successful_downloads.txt')
@@ -119,93 +238,187 @@ async def main(mainArguments: argparse.Namespace) -> None:
         with open(failedPath, 'w', encoding='utf-8') as f:
             f.write('\n'.join(failed))
 
+    if mainArguments.install_locked is None:
+        writeLockfile(MCMD, mainArguments.output, failed)
+
+    if len(missingDependencies) > 0:
+        app_cache.cache('DEPENDENCY_PARAMETERS', {'parameters': parameters, 'output': mainArguments.output, 'installed': list(installed)})
+        await dependencyHandler(missingDependencies, resultsPath)
 
-    async def dependencyHandler(missingDependencies: list[tuple[str, str]]) -> None:
-        print("""
+
+
+async def dependencyHandler(missingDependencies: list[tuple[str, str]], resultsPath: str) -> None:
+    print("""
 Missing Dependencies FOUND
 MissingDependencies.txt created
 
-Run mcmm -rw to open the file and edit it if necessary.
-Make sure to check the detected missing dependencies before trying to resolve. [WIP]
+Run mcmm -rw to open the file and edit it if necessary, mcmm -bl to blacklist the ones you removed from it,
+and mcmm -rd to download the ones left.
+Make sure to check the detected missing dependencies before trying to resolve.
 """)
-            
-        txtfile = []
-        tasks = []
-        
-        prioritize_cf = app_config['Other']['prioritize_cf'] == 'True'
-                        
-        async def getName(dep: tuple[str, int]):
-            name = await MCUtils.getSpecifiedData(dep, ['title', 'name'], prioritizeCF=prioritize_cf)
-            url, hostid = await MCUtils.getSpecifiedData(dep, ['slug', ['links', 'websiteUrl']], prioritizeCF=prioritize_cf)       
-            txtfile.append((name, (url, hostid)))
-         
-                
-        for dep in missingDependencies:
-            tasks.append(getName(dep))
-                
-        await asyncio.gather(*tasks)
-                                        
-        dependencyPath = os.path.join(resultsPath, 'MissingDependencies.txt')           
-        txtfile.sort(key=lambda x: x[0])
-        finaltxt = []
         
-        for txt in txtfile:
-            url = txt[1][0] if txt[1][1] == 1 else f"https://modrinth.com/mod/{txt[1][0]}"
-            finaltxt.append(f"{txt[0][0 ]} [{url}]")
-                
-        with open(dependencyPath, 'w', encoding='utf-8') as f:
-            f.write("- " + "\n- ".join(finaltxt))
+    txtfile = []
+    tasks = []
+    
+    prioritize_cf = app_config['Other']['prioritize_cf'] == 'True'
+                    
+    MCUtils = get_downloader().utils
+                    
+    async def getName(dep: tuple[str, int]):
+        (name, url), hostid = await MCUtils.getSpecifiedDataMany(dep, [['title', 'name'], ['slug', ['links', 'websiteUrl']]], prioritizeCF=prioritize_cf)
+        txtfile.append(((name, hostid), (url, hostid), dep))
+     
+            
+    for dep in missingDependencies:
+        tasks.append(getName(dep))
             
-        absDependencyPath = os.path.abspath(dependencyPath)
-        app_cache('DEPENDENCY_PATH', absDependencyPath)
+    await asyncio.gather(*tasks)
+                                    
+    dependencyPath = os.path.join(resultsPath, 'MissingDependencies.txt')           
+    txtfile.sort(key=lambda x: x[0])
+    finaltxt = []
+    entries = []
+    
+    for txt in txtfile:
+        url = txt[1][0] if txt[1][1] == 1 else f"https://modrinth.com/mod/{txt[1][0]}"
+        finaltxt.append(f"{txt[0][0 ]} [{url}]")
+        entries.append({'url': url, 'ids': list(txt[2])})
+            
+    with open(dependencyPath, 'w', encoding='utf-8') as f:
+        f.write("- " + "\n- ".join(finaltxt))
+        
+    absDependencyPath = os.path.abspath(dependencyPath)
+    app_cache.cache('DEPENDENCY_PATH', absDependencyPath)
+    app_cache.cache('MISSING_DEPENDENCIES', entries) # What each line of the file stands for, read back by -bl and -rd
 
 
-    if len(dependencyIdList) > 0:
-        print("dependencies detected, checking for any missing")
 
-        seen = set()
-        requiredDependencies = [
-            [data, dep['host']] 
-            for dep in dependencyIdList
-            for data in dep['data']
-            if  ((dep['host'] == 'www.curseforge.com' and data['relationType'] == 3) or
-                (dep['host'] == 'modrinth.com' and data['dependency_type'] == 'required')) and
-                tuple(sorted(data.items())) + (dep['host'],) not in seen and not seen.add(tuple(sorted(data.items())) + (dep['host'],))
-        ]
-        
-        equivalentDependencyIds = []
+def reviewedDependencies(dependencyPath: str) -> tuple[list[dict], list[dict]]:
+    """Splits the cached missing dependencies into the ones still listed in MissingDependencies.txt and the ones removed from it.
+    """
+    entries = app_cache.cache('MISSING_DEPENDENCIES') or []
+    
+    with open(dependencyPath, 'r', encoding='utf-8') as f:
+        listed = set(re.findall(r'\[(\S+)\]\s*$', f.read(), re.MULTILINE))
+    
+    kept = [entry for entry in entries if entry['url'] in listed]
+    removed = [entry for entry in entries if entry['url'] not in listed]
+    return kept, removed
 
-        async def dependencyAppendId(data):
-            ids = await MCUtils.get_equivalent_ids(data)
-            equivalentDependencyIds.append(ids)
 
-        tasks = []
-        for data, _ in requiredDependencies:
-            tasks.append(dependencyAppendId(data))
-        
-        await asyncio.gather(*tasks)
 
-        missingDependencies = [
-            dependency for dependency in equivalentDependencyIds
-            if not any(value in [id['data'] for id in downloadedIdList] for value in dependency)
-        ]
-        
-        if len(missingDependencies) > 0:
-            await dependencyHandler(missingDependencies)
+def writeLockfile(MCMD: 'MCModDownloader', output: str, failed: list[str]) -> None:
+    """Merges the files saved this run into the output lockfile, unless some downloads failed (it would miss them)."""
+    if len(MCMD.lock_entries) == 0:
+        return
+    
+    if len(failed) > 0:
+        print("Lockfile not written, some downloads failed")
+        return
+    
+    try:
+        print(f"Lockfile written to {MCMD.write_lockfile(output)}")
+    except (OSError, ValueError) as e:
+        print(f"Lockfile not written: {e}")
+
+
+
+async def resolveReviewed(entries: list[dict], dependencyPath: str) -> None:
+    """Downloads the reviewed missing dependencies, and their own missing dependencies, with the parameters of the run that found them.
+    """
+    cached = app_cache.cache('DEPENDENCY_PARAMETERS')
+    parameters, output = cached['parameters'], cached['output']
+    installed = set(cached['installed'])
+    
+    resolver = build_resolver()
+    missing = resolver.missing([tuple(entry['ids']) for entry in entries], installed)
+    successful, failed, unresolved = await resolver.download(missing, installed, parameters, output)
+    
+    print(f"{len(successful)} dependencies downloaded, {len(unresolved)} could not be resolved")
+    
+    resultsPath = os.path.dirname(dependencyPath)
+    if len(failed) > 0:
+        with open(os.path.join(resultsPath, 'Failed_downloads.txt'), 'a', encoding='utf-8') as f:
+            f.write('\n' + '\n'.join(failed))
+    
+    writeLockfile(get_downloader(), output, failed)
+    
+    app_cache.cache('DEPENDENCY_PARAMETERS', {**cached, 'installed': list(installed)})
+    
+    if len(unresolved) > 0:
+        await dependencyHandler(unresolved, resultsPath)
+    else:
+        os.remove(dependencyPath)
+        app_cache.cache('MISSING_DEPENDENCIES', [])
 
 
 
-def dependencyResolve(args): #WIP
+def dependencyResolve(args) -> tuple[list[dict], str] | None:
+    """Review and blacklist steps of the dependency commands. With -rd, returns the dependencies left to resolve and the file listing them,
+    see resolveReviewed.
+    """
+    dependencyPath = app_cache.cache('DEPENDENCY_PATH')
+    
+    if dependencyPath is None or not os.path.exists(dependencyPath):
+        print("There are no cached dependencies to be resolved")
+        return
+    
     if args.review == True:
-        dependencyPath = app_cache('DEPENDENCY_PATH')
-        
-        if dependencyPath is None:
-            print("There are no cached dependencies to be resolved")
-            return
-                        
         print("Opening file, close the file to continue...")
         open_file_and_wait(dependencyPath)                  
         print('Done!')
+    
+    kept, removed = reviewedDependencies(dependencyPath)
+    
+    if args.blacklist == True:
+        blacklist = fetch_blacklist()
+        for entry in removed:
+            blacklist.update(id for id in entry['ids'] if id is not None)
+        
+        app_blacklist.cache('dependencies', list(blacklist))
+        app_cache.cache('MISSING_DEPENDENCIES', kept)
+        print(f"{len(removed)} dependencies blacklisted")
+    
+    if args.resolve == True:
+        if len(kept) == 0:
+            print("There are no dependencies left to be resolved")
+            return
+        
+        return kept, dependencyPath
+
+
+
+async def inspectInstalled(args: argparse.Namespace) -> None:
+    """-ls and --check-deps, answered from the jars in the mods folder alone."""
+    from mcmm.JarInspector import inspect_jars, missing_dependencies
+    
+    modsPath = os.path.join(args.output, 'mods')
+    jars = sorted(os.path.join(modsPath, file) for file in os.listdir(modsPath) if file.endswith('.jar')) if os.path.isdir(modsPath) else []
+    if len(jars) == 0:
+        print(f"No mods found in {modsPath}")
+        return
+    
+    inspected = await inspect_jars(jars)
+    
+    if args.installed:
+        for jar in inspected:
+            if 'error' in jar:
+                print(f"- {jar['file']}: could not be read ({jar['error']})")
+            elif len(jar['mods']) == 0:
+                print(f"- {jar['file']}: no mod metadata")
+            
+            for mod in jar['mods']:
+                if not mod['bundled']:
+                    bundled = sum(1 for other in jar['mods'] if other['bundled'])
+                    print(f"- {mod['name']} ({mod['id']} {mod['version']}, {mod['loader']}) [{jar['file']}]" + (f" +{bundled} bundled" if bundled else ''))
+    
+    if args.check_deps:
+        missing = missing_dependencies(inspected)
+        if len(missing) == 0:
+            print(f"No missing dependencies in {len(inspected)} jars")
+        
+        for id, requiredBy in sorted(missing.items()):
+            print(f"- {id}, required by {', '.join(requiredBy)}")
 
 
 
@@ -218,6 +431,8 @@ def get_arguments() -> tuple[argparse.Namespace, int]:
     input.add_argument("-m", "--mod-link", help="Single mod download, use a link", metavar="MOD LINK")
     input.add_argument("-ml", "--mod-list", help="Download a bunch of mods simultaneously", metavar="MOD LINKS", nargs="+")
     input.add_argument("-mlt", "--mod-list-txt", "-dlt", help="Download the mods from a txt file containing one mod link per line", metavar="TXT FILE")
+    input.add_argument("-u", "--update", help="Updates the mods already in the output mods folder, only the ones with a newer version are downloaded", action="store_true")
+    input.add_argument("-il", "--install-locked", help=f"Downloads the exact files recorded in a lockfile (default = {LOCKFILE_NAME} in the output directory), without any api call. Files that already match are skipped", metavar="LOCKFILE", nargs='?', const='')
         
     # Mod fetching parameters
     mod_group = parser.add_argument_group(title="Mod filtering parameters", description="Parameters to help fetch specific mod versions")
@@ -229,16 +444,31 @@ def get_arguments() -> tuple[argparse.Namespace, int]:
     extra_group = parser.add_argument_group(title="Extra commands", description="Extra commands for this package")
     extra_group.add_argument("-o", "--output", help=f"Output directory for the mod, current default = '{defaultOutput}'. use -c default-output-dir to set or change this", default=defaultOutput)
     extra_group.add_argument("-c", "--config", help="configurations for this package", nargs='*')
+    extra_group.add_argument("-j", "--jobs", help=f"How many mods are processed at the same time (default = {app_config['Network']['workers']}, set 'workers' in the [Network] section of config.ini to change it)", type=int, metavar="N")
+    extra_group.add_argument("--no-cache", help="Ignores the api response cache for this run, everything is fetched again", action="store_true")
+    extra_group.add_argument("--max-transfers", help=f"Max simultaneous file downloads (default = {app_config['Network']['transfer_slots']})", type=int, metavar="N")
+    extra_group.add_argument("--metrics", help="Writes a json summary of the run (latency quantiles per endpoint, bytes, cache hits, time spent resolving/transferring/waiting) to FILE", metavar="FILE")
+    extra_group.add_argument("--trace", help="Writes one json record per http request of the run to FILE", metavar="FILE")
+    extra_group.add_argument("--prometheus", help="Writes the run metrics to FILE in the Prometheus text format (for the node_exporter textfile collector)", metavar="FILE")
+    extra_group.add_argument("--record", help="Records every request and response of the run into the cassette FILE, to replay it later with --replay. The response cache and id index are left out of recorded runs", metavar="FILE")
+    extra_group.add_argument("--replay", help="Serves the run entirely from the cassette FILE made with --record, without touching the network", metavar="FILE")
+    extra_group.add_argument("--replay-timing", help="'original' waits as long as each recorded response took, 'zero' serves everything right away (and skips recorded rate limits) (default = original)", choices=["original", "zero"], default="original")
+    extra_group.add_argument("-ls", "--installed", help="Lists the mods in the output mods folder, read from the metadata inside each jar (no api calls)", action="store_true")
+    extra_group.add_argument("--import-ids", help="Imports Modrinth <-> Curseforge id pairs into the id index, from a json list or a csv with a modrinth_id,curseforge_id,slug header", metavar="FILE")
     
-    # WIP: Dependency resolution commands - Currently dont do anything     
-    dep_group = parser.add_argument_group(title="Dependency resolution", description="WIP: Commands to help manage and resolve missing dependencies")   
+    # Dependency resolution commands
+    dep_group = parser.add_argument_group(title="Dependency resolution", description="Commands to help manage and resolve missing dependencies")   
      
     dep_group.add_argument("-rd", "--resolve",
-                           help="Not implemented: Attempts to resolve any cached missing dependencies. Before using this command, it's recommended to run `--review` to verify the dependencies, as some mods may report false positives.",
+                           help="Downloads the cached missing dependencies (and their own dependencies). Before using this command, it's recommended to run `--review` to verify the dependencies, as some mods may report false positives. Passed along with a download, the missing dependencies are downloaded in the same run.",
                            action="store_true")
     
     dep_group.add_argument("-bl", "--blacklist",
-                           help="Not implemented: Automatically blacklists any removed dependencies, preventing them from being detected in the future. Use this option to ignore dependencies that are no longer required or are causing issues.",
+                           help="Blacklists any dependencies removed from the missing dependencies file, preventing them from being detected in the future. Use this option to ignore dependencies that are no longer required or are causing issues.",
+                           action="store_true")
+    
+    dep_group.add_argument("--check-deps",
+                           help="Checks the output mods folder for missing required dependencies, from the mod ids each jar declares (fabric.mod.json, quilt.mod.json, mods.toml). Works offline, but only finds the mod ids, not the projects providing them.",
                            action="store_true")
     
     dep_group.add_argument("-rw", "--review",
@@ -249,14 +479,16 @@ def get_arguments() -> tuple[argparse.Namespace, int]:
         args = parser.parse_args()
         
         isDependency = args.resolve or args.blacklist or args.review
-        isDownload = args.mod_link or args.mod_list or args.mod_list_txt
+        isDownload = args.mod_link or args.mod_list or args.mod_list_txt or args.update or args.install_locked is not None
         isConfig = args.config is not None
+        isImport = args.import_ids is not None
+        isLocal = args.installed or args.check_deps
         
-        if not(isDependency or isDownload or isConfig):
+        if not(isDependency or isDownload or isConfig or isImport or isLocal):
             print("Error: You must pass arguments. Try `--help` for usage instructions.")
             raise SystemExit(0)
         
-        return args, 0 if isDownload else 1 if isDependency else 2
+        return args, 0 if isDownload else 1 if isDependency else 2 if isConfig else 3 if isImport else 4
     except SystemExit as e:
         if e.code == 2:
             print("Error: Invalid arguments. Try `--help` for usage instructions.")
@@ -265,13 +497,90 @@ def get_arguments() -> tuple[argparse.Namespace, int]:
 
 
     
+def export_metrics(args: argparse.Namespace):
+    if 'http_client' not in _instances:
+        return
+    metrics = _instances['http_client'].metrics
+    
+    if args.metrics:
+        metrics.write_summary(args.metrics)
+        print(f"Metrics summary written to {args.metrics}")
+    if args.trace:
+        metrics.write_trace(args.trace)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+
+
+
 def run():        
     args, call_type = get_arguments()
+    
+    if args.record and args.replay:
+        print("Error: --record and --replay can not be used together.")
+        return
+    
+    try:
+        dispatch(args, call_type)
+    finally:
+        cassette = _instances['http_client'].cassette if 'http_client' in _instances else None
+        if cassette is not None:
+            cassette.close()
+            if args.record:
+                print(f"Cassette written to {args.record}")
+        export_metrics(args)
+
+
+
+def setup_http_client(args: argparse.Namespace) -> bool:
+    """Applies the network related arguments to the http client, False if the run can not go on."""
+    http_client = get_http_client()
+    http_client.scheduler.configure(workers=args.jobs, transfer=args.max_transfers)
+    http_client.metrics.start()
+    if args.no_cache:
+        http_client.cache = None
+    
+    if args.record or args.replay:
+        import zipfile
+        from mcmm.Cassette import Cassette
         
-    if call_type == 1:
+        # The response cache and the id index would keep requests out of a recording, or ask a replay for ones it never saw
+        http_client.cache = None
+        get_downloader().utils.crosswalk = None
+        
+        if args.record:
+            http_client.cassette = Cassette.record(args.record)
+            http_client.segment_threshold = sys.maxsize # Whole file downloads, a replay answers any Range request out of them
+        else:
+            try:
+                http_client.cassette = Cassette.replay(args.replay, zero_latency=args.replay_timing == 'zero')
+            except (OSError, KeyError, zipfile.BadZipFile) as e:
+                print(f"Could not read the cassette {args.replay}: {e}")
+                return False
+    
+    return True
+
+
+
+def dispatch(args: argparse.Namespace, call_type: int):
+    if call_type == 1 and not args.resolve:
         dependencyResolve(args)
         return
     
+    if call_type == 3:
+        try:
+            imported = get_crosswalk().import_file(args.import_ids)
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            print(f"Could not import {args.import_ids}: {e}")
+            return
+        
+        print(f"{imported} id pairs imported")
+        get_crosswalk().close()
+        return
+    
+    if call_type == 4:
+        asyncio.run(inspectInstalled(args))
+        return
+    
     if call_type == 2:        
         key = _general.get_element(args.config, 0)
         value = _general.get_element(args.config, 1)
@@ -281,8 +590,32 @@ def run():
             configure(key, value, other)
         except ValueError:
             sys.exit(0)
-        
+        return
     
+    if not setup_http_client(args):
+        return
+    
+    asyncio.run(with_http_client(session(args, call_type)))
+
+
+
+async def session(args: argparse.Namespace, call_type: int):
+    """Everything a download or -rd run does over the network, key check included, in a single event loop."""
+    # Locked installs only hit the file hosts and replays never leave the cassette, no api key needed
+    if args.install_locked is None and args.replay is None and not await check_api_key():
+        return
+    
+    if call_type == 1:
+        reviewed = dependencyResolve(args)
+        if reviewed is not None:
+            await resolveReviewed(*reviewed)
+        return
+    
+    await main(args)
+
+
+
+async def check_api_key() -> bool:
     if app_config['Curseforge']['api_key'] == '':
         print(            
 """
@@ -292,9 +625,9 @@ def run():
     If you do not have a API key, go to 'https://console.curseforge.com/#/api-keys' to get one.
 """            
             )
-        return
+        return False
         
-    if not asyncio.run(CFAPI.is_key_valid()):
+    if not await get_downloader().curseforge_api.is_key_valid():
         print(
 """ 
     Invalid CurseForge api key!
@@ -303,9 +636,9 @@ def run():
     If you do not have a API key, go to 'https://console.curseforge.com/#/api-keys' to get one.
 """
             )
-        return
-        
-    asyncio.run(main(args))
+        return False
+    
+    return True
 
 
 
@@ -321,8 +654,9 @@ def configure(key: str|None, value: str|int|None, other: list):
             
             app_config.setConfig('Curseforge', 'api_key', value)
                     
-            CFAPIInstance = CurseforgeAPI()             
-            if not asyncio.run(CFAPIInstance.is_key_valid()):
+            from mcmm.MCSiteAPI import CurseforgeAPI
+            CFAPIInstance = CurseforgeAPI(client=get_http_client())             
+            if not asyncio.run(with_http_client(CFAPIInstance.is_key_valid())):
                 print("Invalid api key")
                 return
                     
@@ -26,6 +26,9 @@ setuptools.setup(
         "furl>=2.1.3",
         "setuptools>=74.0.0"
         ],
+    extras_require={
+        "fast": ["murmurhash2"],
+    },
     entry_points={
         "console_scripts": [
             "mcmm=mcmm.main:run",